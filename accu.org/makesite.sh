@@ -2,5 +2,6 @@
 
 rm -rf public
 hugo -b https://newsite.accu.org
-tar -C content -c --exclude "*.html" journal/ | tar -C public -x
+tar -C content -c --exclude "*.html" --exclude "*.html.gz" --exclude "*.html.br" journal/ | tar -C public -x
+../tools/accu-precompress --cache ../precompress-cache public
 tar -C public -cvzf ../newsite.tar.gz .
@@ -0,0 +1,143 @@
+#!/usr/bin/python3
+#
+# Library code for ACCU website. Simple in-process metrics, written out
+# in the Prometheus text exposition format.
+#
+
+import abc
+import bisect
+import threading
+
+# Default histogram buckets, in seconds.
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+def format_value(v):
+    if v == float('inf'):
+        return '+Inf'
+    return repr(float(v)) if isinstance(v, float) else str(v)
+
+def format_labels(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ''
+    def escape(v):
+        return str(v).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+    return '{' + ','.join('{}="{}"'.format(n, escape(v)) for n, v in pairs) + '}'
+
+class Metric(abc.ABC):
+    """Base for a named metric, with a value for each set of label values."""
+    kind = None
+
+    def __init__(self, name, help, labels=()):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self.values = {}
+        self.lock = threading.Lock()
+
+    def key(self, labels):
+        if len(labels) != len(self.labels):
+            raise ValueError('{} expects labels {}'.format(self.name, self.labels))
+        return tuple(labels)
+
+    @abc.abstractmethod
+    def samples(self):
+        """Yield (sample name, formatted labels, value) for each sample."""
+
+    def render(self):
+        res = ['# HELP {} {}'.format(self.name, self.help),
+               '# TYPE {} {}'.format(self.name, self.kind)]
+        for name, labels, value in self.samples():
+            res.append('{}{} {}'.format(name, labels, format_value(value)))
+        return res
+
+class Counter(Metric):
+    kind = 'counter'
+
+    def inc(self, *labels, amount=1):
+        key = self.key(labels)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+    def samples(self):
+        with self.lock:
+            values = sorted(self.values.items())
+        for key, value in values:
+            yield self.name, format_labels(self.labels, key), value
+
+class FunctionCounter(Metric):
+    """A counter whose values are read by calling func when rendered.
+
+    func returns a list of (label values, count) pairs.
+    """
+    kind = 'counter'
+
+    def __init__(self, name, help, func, labels=()):
+        super().__init__(name, help, labels)
+        self.func = func
+
+    def samples(self):
+        for key, value in self.func():
+            yield self.name, format_labels(self.labels, self.key(key)), value
+
+class Histogram(Metric):
+    kind = 'histogram'
+
+    def __init__(self, name, help, labels=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, help, labels)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value, *labels):
+        key = self.key(labels)
+        with self.lock:
+            entry = self.values.get(key)
+            if entry is None:
+                entry = self.values[key] = [[0] * len(self.buckets), 0, 0.0]
+            i = bisect.bisect_left(self.buckets, value)
+            if i < len(self.buckets):
+                entry[0][i] += 1
+            entry[1] += 1
+            entry[2] += value
+
+    def samples(self):
+        with self.lock:
+            values = sorted((k, (list(v[0]), v[1], v[2])) for k, v in self.values.items())
+        for key, (counts, count, total) in values:
+            cumulative = 0
+            for bound, n in zip(self.buckets, counts):
+                cumulative += n
+                yield (self.name + '_bucket',
+                       format_labels(self.labels, key, [('le', format_value(float(bound)))]),
+                       cumulative)
+            yield self.name + '_bucket', format_labels(self.labels, key, [('le', '+Inf')]), count
+            yield self.name + '_count', format_labels(self.labels, key), count
+            yield self.name + '_sum', format_labels(self.labels, key), total
+
+class Registry:
+    """A collection of metrics, rendered together."""
+
+    def __init__(self):
+        self.metrics = []
+
+    def add(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def counter(self, name, help, labels=()):
+        return self.add(Counter(name, help, labels))
+
+    def function_counter(self, name, help, func, labels=()):
+        return self.add(FunctionCounter(name, help, func, labels))
+
+    def histogram(self, name, help, labels=(), buckets=DEFAULT_BUCKETS):
+        return self.add(Histogram(name, help, labels, buckets))
+
+    def render(self):
+        res = []
+        for metric in self.metrics:
+            res.extend(metric.render())
+        return '\n'.join(res) + '\n'
+
+# Local Variables:
+# mode: Python
+# End:
@@ -4,39 +4,225 @@
 #
 
 import argparse
+import collections
+import contextlib
 import hashlib
+import os
+import queue
 import sys
+import threading
+import time
 
 import pymysql
 
-class Checker:
-    def __init__(self, dbhost, dbpass):
-        self.db = pymysql.connect(host=dbhost,
-                                  user='accuorg_xarad',
-                                  password=dbpass,
-                                  db='accuorg_xar',
-                                  charset='latin1')
-
-    def __getuser(self, username, userpass):
-        cursor = self.db.cursor()
+class CheckerError(Exception):
+    """Raised when the user database can't be checked."""
+    pass
+
+class PoolTimeout(CheckerError):
+    pass
+
+class ConnectionPool:
+    """A bounded, thread-safe pool of database connections.
+
+    At most size connections are in use at once. acquire() waits up to
+    timeout seconds for a connection to be free. Connections are made
+    as needed, and one that has been idle more than ping_interval seconds
+    is checked before reuse, and replaced if it has gone away. A
+    connection on which an error occurred is closed rather than reused.
+    """
+
+    def __init__(self, connect, size=5, timeout=10, ping_interval=30):
+        self.connect = connect
+        self.timeout = timeout
+        self.ping_interval = ping_interval
+        self.idle = queue.LifoQueue()
+        self.slots = threading.BoundedSemaphore(size)
+
+    @staticmethod
+    def close_quietly(conn):
+        try:
+            conn.close()
+        except Exception:
+            pass
+
+    def acquire(self):
+        if not self.slots.acquire(timeout=self.timeout):
+            raise PoolTimeout('No database connection free after {}s'.format(self.timeout))
         try:
-            cursor.execute('SELECT xar_pass, xar_name, xar_status FROM xar_roles LEFT JOIN xar_subscriptions USING (xar_uid) WHERE xar_uname=%s', username)
-            row = cursor.fetchone()
-            m = hashlib.md5()
-            m.update(userpass.encode('latin1'))
-            if m.hexdigest() != row[0]:
-                return ()
-            return (row[1], row[2])
+            try:
+                conn, last_used = self.idle.get_nowait()
+            except queue.Empty:
+                return self.connect()
+            if time.monotonic() - last_used > self.ping_interval:
+                try:
+                    conn.ping(reconnect=False)
+                except pymysql.MySQLError:
+                    self.close_quietly(conn)
+                    conn = self.connect()
+            return conn
         except:
-            return ()
+            self.slots.release()
+            raise
+
+    def release(self, conn, broken=False):
+        if broken:
+            self.close_quietly(conn)
+        else:
+            self.idle.put((conn, time.monotonic()))
+        self.slots.release()
+
+    @contextlib.contextmanager
+    def connection(self):
+        conn = self.acquire()
+        try:
+            yield conn
+        except pymysql.MySQLError:
+            self.release(conn, broken=True)
+            raise
+        except:
+            self.release(conn)
+            raise
+        else:
+            self.release(conn)
+
+class VerdictCache:
+    """A bounded cache of login verdicts, each kept for at most ttl seconds.
+
+    Entries are keyed on a hash of the credentials with a salt chosen
+    when the cache is created, so credentials aren't held in memory. The
+    least recently used entry is dropped when the cache is full. Counts
+    of hits and misses are kept.
+    """
+
+    def __init__(self, size, ttl):
+        self.size = size
+        self.ttl = ttl
+        self.salt = os.urandom(16)
+        self.entries = collections.OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def key(self, username, userpass):
+        h = hashlib.sha256(self.salt)
+        h.update(username.encode('utf-8'))
+        h.update(b'\0')
+        h.update(userpass.encode('utf-8'))
+        return h.digest()
+
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            if entry[1] < time.monotonic():
+                del self.entries[key]
+                self.misses += 1
+                return None
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def put(self, key, verdict):
+        with self.lock:
+            self.entries[key] = (verdict, time.monotonic() + self.ttl)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.size:
+                self.entries.popitem(last=False)
+
+class Checker:
+    # Verdicts on a username and password.
+    UNKNOWN = 0
+    USER = 1
+    MEMBER = 2
+
+    def __init__(self, dbhost, dbpass, pool_size=1, pool_timeout=10, cache_size=0, cache_ttl=300,
+                 query_observer=None):
+        # query_observer, if given, is called with the time in seconds
+        # taken by each user database query, including retries.
+        def connect():
+            # Autocommit, so a pooled connection doesn't keep reading
+            # from an old transaction snapshot.
+            return pymysql.connect(host=dbhost,
+                                   user='accuorg_xarad',
+                                   password=dbpass,
+                                   db='accuorg_xar',
+                                   charset='latin1',
+                                   autocommit=True)
+        self.pool = ConnectionPool(connect, pool_size, pool_timeout)
+        self.cache = VerdictCache(cache_size, cache_ttl) if cache_size > 0 else None
+        self.query_observer = query_observer
+
+    def __query(self, sql, args):
+        if self.query_observer is None:
+            return self.__execute(sql, args)
+        start = time.perf_counter()
+        try:
+            return self.__execute(sql, args)
+        finally:
+            self.query_observer(time.perf_counter() - start)
+
+    def __execute(self, sql, args):
+        # Try again once with a fresh connection, in case the pooled
+        # connection has dropped.
+        for attempt in range(2):
+            try:
+                with self.pool.connection() as db:
+                    with db.cursor() as cursor:
+                        cursor.execute(sql, args)
+                        return cursor.fetchone()
+            except (pymysql.OperationalError, pymysql.InterfaceError) as err:
+                if attempt:
+                    raise CheckerError('User database error: {}'.format(err)) from err
+            except pymysql.MySQLError as err:
+                raise CheckerError('User database error: {}'.format(err)) from err
+
+    @staticmethod
+    def encode_password(userpass):
+        # Xaraya hashes Latin-1 passwords, so one that can't be encoded
+        # can't match.
+        try:
+            return userpass.encode('latin1')
+        except UnicodeEncodeError:
+            return None
+
+    def __getverdict(self, username, password):
+        row = self.__query('SELECT xar_pass, xar_status FROM xar_roles LEFT JOIN xar_subscriptions USING (xar_uid) WHERE xar_uname=%s', username)
+        if not row:
+            return self.UNKNOWN
+        m = hashlib.md5()
+        m.update(password)
+        if m.hexdigest() != row[0]:
+            return self.UNKNOWN
+        return self.MEMBER if row[1] == 1 else self.USER
+
+    def verdict(self, username, userpass):
+        """Return whether username and password are a member, a user or unknown.
+
+        Only member and user verdicts are cached, so failed logins
+        can't fill the cache. A password that can't be encoded is
+        rejected before the cache is consulted.
+        """
+        password = self.encode_password(userpass)
+        if password is None:
+            return self.UNKNOWN
+        if self.cache is None:
+            return self.__getverdict(username, password)
+        key = self.cache.key(username, userpass)
+        res = self.cache.get(key)
+        if res is None:
+            res = self.__getverdict(username, password)
+            if res != self.UNKNOWN:
+                self.cache.put(key, res)
+        return res
 
     def user(self, username, userpass):
-        user_info = self.__getuser(username, userpass)
-        return bool(user_info)
+        return self.verdict(username, userpass) != self.UNKNOWN
 
     def member(self, username, userpass):
-        user_info = self.__getuser(username, userpass)
-        return bool(user_info) and user_info[1] == 1
+        return self.verdict(username, userpass) == self.MEMBER
 
 def main():
     parser = argparse.ArgumentParser(description='test password library')
@@ -55,9 +241,10 @@ def main():
     args = parser.parse_args()
 
     checker = Checker(args.dbhost, args.dbpass)
-    if checker.member(args.user, args.passwd):
+    verdict = checker.verdict(args.user, args.passwd)
+    if verdict == Checker.MEMBER:
         print('User \'{name}\' is ACCU member.'.format(name=args.user))
-    elif checker.user(args.user, args.passwd):
+    elif verdict == Checker.USER:
         print('Name \'{name}\' is ACCU website user.'.format(name=args.user))
     else:
         print('Unknown user or wrong password')
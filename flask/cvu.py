@@ -1,17 +1,45 @@
+from collections import OrderedDict
 from configparser import ConfigParser
-from os.path import expanduser
-from flask import Flask, flash, render_template, redirect, request, url_for
+from datetime import datetime, timezone
+from hashlib import md5
+from hmac import compare_digest
+from os import makedirs, stat
+from os.path import basename, expanduser
+from threading import Lock
+from time import perf_counter
+from flask import Flask, abort, flash, g, make_response, render_template, redirect, request, send_file, session, url_for
+from jinja2 import FileSystemBytecodeCache, TemplateNotFound, meta, nodes
+from werkzeug.http import is_resource_modified
 from flask_login import current_user, login_required, login_user, logout_user, LoginManager
 from flask_wtf import FlaskForm
 from wtforms import StringField, PasswordField, BooleanField, SubmitField
 from wtforms.validators import DataRequired
 
-from accupassword import Checker
+import accumetrics
+from accupassword import Checker, CheckerError
 
 _defaults = {
     'database': {
         'host': 'localhost',
-        'password': 'NotTheActualPassword'
+        'password': 'NotTheActualPassword',
+        'pool_size': '5',
+        'pool_timeout': '10'
+    },
+    'login': {
+        'cache_size': '0',
+        'cache_ttl': '300'
+    },
+    'journal': {
+        'render_cache_size': '67108864',
+        'render_cache_templates': '4096',
+        'send_static': 'true',
+        'use_x_sendfile': 'false'
+    },
+    'templates': {
+        'bytecode_cache': ''
+    },
+    'metrics': {
+        'token': ''
     }
 }
 
@@ -28,13 +56,149 @@ class Config(ConfigParser):
 
 app = Flask(__name__)
 app.config['SECRET_KEY'] = 'wjMB4SQxSY_3nuvYmpYyWg'
+# Pick up edited templates without a restart.
+app.config['TEMPLATES_AUTO_RELOAD'] = True
 
 login_manager = LoginManager()
 login_manager.login_view = 'login'
 login_manager.init_app(app)
 
 cfg = Config()
-password_checker = Checker(cfg['database']['host'], cfg['database']['password'])
+
+metrics = accumetrics.Registry()
+request_time = metrics.histogram('cvu_request_seconds', 'Time taken to handle a request.',
+                                 labels=('route', 'method'))
+render_time = metrics.histogram('cvu_render_seconds', 'Time taken to render a journal page.')
+db_query_time = metrics.histogram('cvu_login_db_query_seconds', 'Time taken by user database queries.')
+
+password_checker = Checker(cfg['database']['host'], cfg['database']['password'],
+                           pool_size=cfg.getint('database', 'pool_size'),
+                           pool_timeout=cfg.getfloat('database', 'pool_timeout'),
+                           cache_size=cfg.getint('login', 'cache_size'),
+                           cache_ttl=cfg.getfloat('login', 'cache_ttl'),
+                           query_observer=db_query_time.observe)
+
+# Keep compiled templates across restarts. Empty means a per-user temporary directory.
+bytecode_cache_dir = cfg['templates']['bytecode_cache'] or None
+if bytecode_cache_dir:
+    makedirs(bytecode_cache_dir, exist_ok=True)
+app.jinja_env.bytecode_cache = FileSystemBytecodeCache(bytecode_cache_dir)
+
+class RenderCache:
+    """Cache of rendered journal pages.
+
+    Pages are keyed on the path, mtime and size of the page template
+    and every template it extends, includes or imports, so a page is
+    rendered again when any of them is updated. A cached page is shown
+    to every user, so pages whose templates use the request, session,
+    g or current_user, or that show flashed messages, must not be
+    cached. The total size of
+    cached pages is kept below max_size characters, dropping the least
+    recently used first. Also remember the file name of each template,
+    and, for at most max_templates versions of templates, whether each
+    is a plain static file with no template markup, and which templates
+    it refers to and whether it uses the request, so a template is only
+    read when it has changed. Counts of hits and misses are kept.
+    """
+    def __init__(self, max_size, max_templates=4096):
+        self.max_size = max_size
+        self.max_templates = max_templates
+        self.size = 0
+        self.pages = OrderedDict()
+        self.templates = OrderedDict()
+        self.filenames = {}
+        self.lock = Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        with self.lock:
+            page = self.pages.get(key)
+            if page is not None:
+                self.pages.move_to_end(key)
+                self.hits += 1
+            else:
+                self.misses += 1
+            return page
+
+    def put(self, key, page):
+        if len(page) > self.max_size:
+            return
+        with self.lock:
+            old = self.pages.pop(key, None)
+            if old is not None:
+                self.size -= len(old)
+            self.pages[key] = page
+            self.size += len(page)
+            while self.size > self.max_size:
+                old_key, old = self.pages.popitem(last=False)
+                self.size -= len(old)
+
+    # Template globals that differ between requests or users.
+    request_globals = frozenset(('request', 'session', 'g', 'current_user'))
+
+    def template_info(self, key, load, env):
+        """Return (is static, names of referenced templates, uses request) for a template.
+
+        load is called to get the template source if it isn't known.
+        """
+        with self.lock:
+            res = self.templates.get(key)
+            if res is not None:
+                self.templates.move_to_end(key)
+                return res
+        source = load()
+        static = not any(m in source for m in ('{{', '{%', '{#'))
+        if static:
+            res = (True, (), False)
+        else:
+            ast = env.parse(source)
+            # Templates named only when rendering can't be found.
+            refs = tuple(name for name in meta.find_referenced_templates(ast) if name)
+            # Flask's request globals are environment globals, which
+            # meta.find_undeclared_variables leaves out.
+            names = {node.name for node in ast.find_all(nodes.Name) if node.ctx == 'load'}
+            res = (False, refs, bool(names & self.request_globals))
+        with self.lock:
+            self.templates[key] = res
+            while len(self.templates) > self.max_templates:
+                self.templates.popitem(last=False)
+        return res
+
+render_cache = RenderCache(cfg.getint('journal', 'render_cache_size'),
+                           cfg.getint('journal', 'render_cache_templates'))
+# Plain static pages are sent as files, choosing a precompressed
+# variant when the client accepts one, rather than rendered. Turn off to
+# render every page. Handing the files to the front-end server with
+# X-Sendfile is a separate option.
+send_static = cfg.getboolean('journal', 'send_static')
+app.config['USE_X_SENDFILE'] = cfg.getboolean('journal', 'use_x_sendfile')
+metrics_token = cfg['metrics']['token']
+
+def cache_counts(*caches):
+    res = []
+    for name, cache in caches:
+        if cache is not None:
+            res.append(((name, 'hit'), cache.hits))
+            res.append(((name, 'miss'), cache.misses))
+    return res
+
+metrics.function_counter('cvu_cache_requests_total', 'Cache lookups, by cache and result.',
+                         lambda: cache_counts(('render', render_cache),
+                                              ('login', password_checker.cache)),
+                         labels=('cache', 'result'))
+
+@app.before_request
+def start_timer():
+    g.request_start = perf_counter()
+
+@app.after_request
+def record_request_time(response):
+    start = g.pop('request_start', None)
+    if start is not None:
+        route = request.url_rule.rule if request.url_rule else 'unmatched'
+        request_time.observe(perf_counter() - start, route, request.method)
+    return response
 
 class Member:
     def __init__(self, name=None):
@@ -68,7 +232,13 @@ def login():
         return redirect('/')
     form = LoginForm()
     if form.validate_on_submit():
-        if password_checker.member(form.username.data, form.password.data):
+        try:
+            is_member = password_checker.member(form.username.data, form.password.data)
+        except CheckerError:
+            app.logger.exception('Login check failed')
+            flash('Sorry, login is not available at the moment. Please try again later')
+            return redirect(url_for('login'))
+        if is_member:
             user = Member(form.username.data)
             login_user(user, remember=form.remember_me.data)
             next_page = request.args.get('next')
@@ -86,10 +256,127 @@ def logout():
     logout_user()
     return redirect('/')
 
+# Precompressed variants written by accu-precompress, most preferred first.
+precompressed = (('br', '.br'), ('gzip', '.gz'))
+
+def precompressed_variant(filename, st):
+    """Return (encoding, path) of an up to date precompressed variant the client accepts."""
+    for encoding, suffix in precompressed:
+        if encoding not in request.accept_encodings:
+            continue
+        try:
+            vst = stat(filename + suffix)
+        except OSError:
+            continue
+        if vst.st_mtime_ns >= st.st_mtime_ns:
+            return encoding, filename + suffix
+    return None, filename
+
+def template_state(name):
+    """Return (path, mtime, size), file name, stat and template_info() for a template.
+
+    The file name is looked up once, and the source only read if that
+    version of the template isn't known. Raises TemplateNotFound.
+    """
+    filename = render_cache.filenames.get(name)
+    if filename is None:
+        filename = app.jinja_loader.get_source(app.jinja_env, name)[1]
+        render_cache.filenames[name] = filename
+    try:
+        st = stat(filename)
+    except FileNotFoundError:
+        render_cache.filenames.pop(name, None)
+        raise TemplateNotFound(name)
+    key = (name, st.st_mtime_ns, st.st_size)
+    info = render_cache.template_info(key, lambda: app.jinja_loader.get_source(app.jinja_env, name)[0],
+                                      app.jinja_env)
+    return key, filename, st, info
+
+def template_version(page_key, refs, uses_request):
+    """Return (path, mtime, size) of a page template and all the templates it
+    refers to, and whether any of them use the request."""
+    res = [page_key]
+    seen = {page_key[0]}
+    pending = list(refs)
+    while pending:
+        name = pending.pop()
+        if name in seen:
+            continue
+        seen.add(name)
+        try:
+            key, filename, st, (static, more, more_request) = template_state(name)
+        except TemplateNotFound:
+            continue
+        res.append(key)
+        pending.extend(more)
+        uses_request = uses_request or more_request
+    return tuple(res), uses_request
+
 @app.route('/journal/<path:page_path>')
 @login_required
 def render_static(page_path):
-    return render_template(page_path)
+    try:
+        page_key, filename, st, (static, refs, uses_request) = template_state(page_path)
+    except TemplateNotFound:
+        abort(404)
+    # Plain static files are sent as they are, or precompressed.
+    if send_static and static:
+        encoding, path = precompressed_variant(filename, st)
+        # The type comes from the page's name, not the variant's.
+        response = send_file(path, download_name=basename(filename),
+                             conditional=True, max_age=0)
+        if encoding:
+            response.content_encoding = encoding
+        response.vary.add('Accept-Encoding')
+        response.cache_control.private = True
+        return response
+    key, uses_request = template_version(page_key, refs, uses_request)
+    # A page showing flashed messages, or depending on the request,
+    # isn't cached here, and has no validators so the browser can't
+    # revalidate it later.
+    if uses_request or '_flashes' in session:
+        start = perf_counter()
+        response = make_response(render_template(page_path))
+        render_time.observe(perf_counter() - start)
+        response.cache_control.private = True
+        response.cache_control.no_cache = True
+        return response
+    # Members-only, so only the browser may cache, and must revalidate.
+    etag = md5(repr(key).encode('utf-8')).hexdigest()
+    last_modified = datetime.fromtimestamp(max(k[1] for k in key) // 10**9, timezone.utc)
+    if not is_resource_modified(request.environ, etag=etag, last_modified=last_modified):
+        response = make_response('', 304)
+    else:
+        page = render_cache.get(key)
+        if page is None:
+            start = perf_counter()
+            page = render_template(page_path)
+            render_time.observe(perf_counter() - start)
+            render_cache.put(key, page)
+        response = make_response(page)
+    response.set_etag(etag)
+    response.last_modified = last_modified
+    response.cache_control.private = True
+    response.cache_control.no_cache = True
+    return response
+
+@app.route('/metrics')
+def show_metrics():
+    # Only available when a token is configured, and given it as a
+    # bearer token.
+    if not metrics_token:
+        abort(404)
+    auth = request.headers.get('Authorization', '')
+    if not compare_digest(auth.encode('utf-8'), 'Bearer {}'.format(metrics_token).encode('utf-8')):
+        response = make_response('Unauthorized\n', 401)
+        response.mimetype = 'text/plain'
+        response.headers['WWW-Authenticate'] = 'Bearer'
+        return response
+    response = make_response(metrics.render())
+    response.mimetype = 'text/plain'
+    response.headers['Content-Type'] = 'text/plain; version=0.0.4; charset=utf-8'
+    response.cache_control.no_store = True
+    return response
 
 if __name__ == '__main__':
     app.run()
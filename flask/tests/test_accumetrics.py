@@ -0,0 +1,66 @@
+import pytest
+
+import accumetrics
+
+def test_metric_is_abstract():
+    with pytest.raises(TypeError):
+        accumetrics.Metric('m', 'Help.')
+
+def test_counter():
+    registry = accumetrics.Registry()
+    requests = registry.counter('requests_total', 'Requests handled.', labels=('method', 'path'))
+    requests.inc('GET', '/a')
+    requests.inc('GET', '/a')
+    requests.inc('POST', 'say "hi"\\\n', amount=3)
+    with pytest.raises(ValueError):
+        requests.inc('GET')
+    assert registry.render() == (
+        '# HELP requests_total Requests handled.\n'
+        '# TYPE requests_total counter\n'
+        'requests_total{method="GET",path="/a"} 2\n'
+        'requests_total{method="POST",path="say \\"hi\\"\\\\\\n"} 3\n')
+
+def test_function_counter():
+    registry = accumetrics.Registry()
+    registry.function_counter('lookups_total', 'Lookups.',
+                              lambda: [(('render', 'hit'), 5), (('render', 'miss'), 1)],
+                              labels=('cache', 'result'))
+    registry.function_counter('calls_total', 'Calls.', lambda: [((), 7)])
+    assert registry.render() == (
+        '# HELP lookups_total Lookups.\n'
+        '# TYPE lookups_total counter\n'
+        'lookups_total{cache="render",result="hit"} 5\n'
+        'lookups_total{cache="render",result="miss"} 1\n'
+        '# HELP calls_total Calls.\n'
+        '# TYPE calls_total counter\n'
+        'calls_total 7\n')
+
+def test_histogram():
+    registry = accumetrics.Registry()
+    latency = registry.histogram('latency_seconds', 'Latency.', buckets=(1, 0.1, 0.5))
+    for value in (0.05, 0.1, 0.3, 0.7, 2.5):
+        latency.observe(value)
+    assert registry.render() == (
+        '# HELP latency_seconds Latency.\n'
+        '# TYPE latency_seconds histogram\n'
+        'latency_seconds_bucket{le="0.1"} 2\n'
+        'latency_seconds_bucket{le="0.5"} 3\n'
+        'latency_seconds_bucket{le="1.0"} 4\n'
+        'latency_seconds_bucket{le="+Inf"} 5\n'
+        'latency_seconds_count 5\n'
+        'latency_seconds_sum 3.65\n')
+
+def test_histogram_labels():
+    latency = accumetrics.Histogram('t', 'T.', labels=('route',), buckets=(1,))
+    latency.observe(2, '/b')
+    latency.observe(0.5, '/a')
+    assert list(latency.samples()) == [
+        ('t_bucket', '{route="/a",le="1.0"}', 1),
+        ('t_bucket', '{route="/a",le="+Inf"}', 1),
+        ('t_count', '{route="/a"}', 1),
+        ('t_sum', '{route="/a"}', 0.5),
+        ('t_bucket', '{route="/b",le="1.0"}', 0),
+        ('t_bucket', '{route="/b",le="+Inf"}', 1),
+        ('t_count', '{route="/b"}', 1),
+        ('t_sum', '{route="/b"}', 2.0),
+        ]
@@ -0,0 +1,226 @@
+import hashlib
+import threading
+import time
+
+import pymysql
+import pytest
+
+import accupassword
+
+def md5(password):
+    return hashlib.md5(password.encode('latin1')).hexdigest()
+
+class FakeCursor:
+    def __init__(self, db):
+        self.db = db
+        self.row = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        pass
+
+    def execute(self, sql, args):
+        if self.db.errors:
+            raise self.db.errors.pop(0)
+        self.db.queries.append(args)
+        self.row = self.db.users.get(args)
+
+    def fetchone(self):
+        return self.row
+
+class FakeDb:
+    def __init__(self, queries=None, errors=None):
+        # Errors, if given, are raised in turn by queries.
+        self.queries = [] if queries is None else queries
+        self.errors = [] if errors is None else errors
+        self.users = {
+            'member': (md5('pässwörd'), 1),
+            'user': (md5('password'), None),
+            }
+        self.alive = True
+        self.closed = False
+
+    def cursor(self):
+        return FakeCursor(self)
+
+    def ping(self, reconnect=False):
+        if not self.alive:
+            raise pymysql.OperationalError(2006, 'MySQL server has gone away')
+
+    def close(self):
+        self.closed = True
+
+class FakeServer:
+    """Makes a new FakeDb for each connect, sharing queries and errors."""
+
+    def __init__(self):
+        self.connections = []
+        self.queries = []
+        self.errors = []
+        self.refuse = 0
+
+    def connect(self, **kwargs):
+        if self.refuse:
+            self.refuse -= 1
+            raise pymysql.OperationalError(2003, "Can't connect to MySQL server")
+        db = FakeDb(self.queries, self.errors)
+        self.connections.append(db)
+        return db
+
+@pytest.fixture
+def db(monkeypatch):
+    db = FakeDb()
+    monkeypatch.setattr(pymysql, 'connect', lambda **kwargs: db)
+    return db
+
+@pytest.mark.parametrize('cache_size', [0, 10])
+def test_verdict(db, cache_size):
+    checker = accupassword.Checker('localhost', 'secret', cache_size=cache_size)
+    assert checker.verdict('member', 'pässwörd') == checker.MEMBER
+    assert checker.verdict('user', 'password') == checker.USER
+    assert checker.verdict('user', 'wrong') == checker.UNKNOWN
+    assert checker.verdict('nobody', 'password') == checker.UNKNOWN
+    assert checker.member('member', 'pässwörd')
+    assert not checker.member('user', 'password')
+    assert checker.user('user', 'password')
+
+@pytest.mark.parametrize('cache_size', [0, 10])
+def test_non_latin1_password(db, cache_size):
+    checker = accupassword.Checker('localhost', 'secret', cache_size=cache_size)
+    assert checker.verdict('member', 'pässwörd€') == checker.UNKNOWN
+    assert not checker.user('member', 'pässwörd€')
+
+def test_non_latin1_password_not_cached(db):
+    checker = accupassword.Checker('localhost', 'secret', cache_size=10)
+    for i in range(2):
+        assert checker.verdict('member', 'pässwörd€') == checker.UNKNOWN
+    assert db.queries == []
+    assert len(checker.cache.entries) == 0
+    assert checker.cache.hits == checker.cache.misses == 0
+    # Valid credentials are still cached.
+    for i in range(2):
+        assert checker.verdict('member', 'pässwörd') == checker.MEMBER
+    assert db.queries == ['member']
+    assert checker.cache.hits == checker.cache.misses == 1
+
+@pytest.fixture
+def server(monkeypatch):
+    server = FakeServer()
+    monkeypatch.setattr(pymysql, 'connect', server.connect)
+    return server
+
+def test_pool_reuse():
+    server = FakeServer()
+    pool = accupassword.ConnectionPool(server.connect, size=2)
+    with pool.connection() as first:
+        with pool.connection() as second:
+            assert first is not second
+    # The most recently released connection is reused.
+    with pool.connection() as conn:
+        assert conn is first
+    assert len(server.connections) == 2
+
+def test_pool_timeout():
+    server = FakeServer()
+    pool = accupassword.ConnectionPool(server.connect, size=1, timeout=0.05)
+    conn = pool.acquire()
+    with pytest.raises(accupassword.PoolTimeout):
+        pool.acquire()
+    pool.release(conn)
+    assert pool.acquire() is conn
+
+def test_pool_waits():
+    server = FakeServer()
+    pool = accupassword.ConnectionPool(server.connect, size=1, timeout=5)
+    conn = pool.acquire()
+    timer = threading.Timer(0.05, pool.release, [conn])
+    timer.start()
+    start = time.monotonic()
+    assert pool.acquire() is conn
+    assert time.monotonic() - start >= 0.04
+    timer.join()
+
+def test_pool_stale_connection():
+    server = FakeServer()
+    pool = accupassword.ConnectionPool(server.connect, size=1, ping_interval=-1)
+    with pool.connection() as conn:
+        pass
+    conn.alive = False
+    with pool.connection() as fresh:
+        assert fresh is not conn
+    assert conn.closed
+    # A connection that answers the ping is kept.
+    with pool.connection() as again:
+        assert again is fresh
+    assert not fresh.closed
+
+def test_pool_broken_connection():
+    server = FakeServer()
+    pool = accupassword.ConnectionPool(server.connect, size=1, timeout=0.05)
+    with pytest.raises(pymysql.MySQLError):
+        with pool.connection() as conn:
+            raise pymysql.OperationalError(2013, 'Lost connection')
+    assert conn.closed
+    # Other errors don't break the connection.
+    with pytest.raises(KeyError):
+        with pool.connection() as fresh:
+            raise KeyError('x')
+    assert fresh is not conn and not fresh.closed
+    with pool.connection() as again:
+        assert again is fresh
+
+def test_pool_connect_fails():
+    server = FakeServer()
+    server.refuse = 1
+    pool = accupassword.ConnectionPool(server.connect, size=1, timeout=0.05)
+    with pytest.raises(pymysql.OperationalError):
+        pool.acquire()
+    # The slot is free again.
+    pool.release(pool.acquire())
+
+@pytest.mark.parametrize('error', [pymysql.OperationalError(2013, 'Lost connection'),
+                                   pymysql.InterfaceError(0, '')])
+def test_checker_retry(server, error):
+    checker = accupassword.Checker('localhost', 'secret', pool_timeout=0.05)
+    server.errors.append(error)
+    assert checker.verdict('user', 'password') == checker.USER
+    assert len(server.connections) == 2
+    assert server.connections[0].closed
+    assert server.queries == ['user']
+
+def test_checker_retry_fails(server):
+    observed = []
+    checker = accupassword.Checker('localhost', 'secret', pool_timeout=0.05, query_observer=observed.append)
+    server.errors.extend([pymysql.OperationalError(2013, 'Lost connection'),
+                          pymysql.OperationalError(2013, 'Lost connection')])
+    with pytest.raises(accupassword.CheckerError):
+        checker.verdict('user', 'password')
+    assert len(server.connections) == 2
+    assert len(observed) == 1
+    # The pool recovers once the database does.
+    assert checker.verdict('user', 'password') == checker.USER
+
+def test_checker_connect_fails(server):
+    checker = accupassword.Checker('localhost', 'secret', pool_timeout=0.05)
+    server.refuse = 2
+    with pytest.raises(accupassword.CheckerError):
+        checker.verdict('user', 'password')
+    assert checker.verdict('user', 'password') == checker.USER
+
+def test_checker_no_retry(server):
+    checker = accupassword.Checker('localhost', 'secret', pool_timeout=0.05)
+    server.errors.append(pymysql.ProgrammingError(1146, "Table doesn't exist"))
+    with pytest.raises(accupassword.CheckerError):
+        checker.verdict('user', 'password')
+    assert len(server.connections) == 1
+    assert server.connections[0].closed
+
+def test_checker_pool_timeout(server):
+    checker = accupassword.Checker('localhost', 'secret', pool_timeout=0.05)
+    conn = checker.pool.acquire()
+    with pytest.raises(accupassword.CheckerError):
+        checker.verdict('user', 'password')
+    checker.pool.release(conn)
+    assert checker.verdict('user', 'password') == checker.USER
@@ -0,0 +1,161 @@
+import os
+
+import jinja2
+import pytest
+
+import cvu
+
+@pytest.fixture
+def templates(tmp_path, monkeypatch):
+    monkeypatch.setattr(cvu.app, 'jinja_loader', jinja2.FileSystemLoader(str(tmp_path)))
+    monkeypatch.setattr(cvu, 'render_cache', cvu.RenderCache(1 << 20))
+    monkeypatch.setitem(cvu.app.config, 'LOGIN_DISABLED', True)
+    monkeypatch.setitem(cvu.app.config, 'USE_X_SENDFILE', False)
+    monkeypatch.setattr(cvu, 'send_static', True)
+    # Other tests' templates have the same names.
+    cvu.app.jinja_env.cache.clear()
+    return tmp_path
+
+@pytest.fixture
+def client(templates):
+    return cvu.app.test_client()
+
+def write(path, text, mtime):
+    path.write_text(text)
+    os.utime(str(path), (mtime, mtime))
+
+def test_page_depends_on_base(templates, client):
+    write(templates / 'base.html', '<p>Old</p>{% block body %}{% endblock %}', 1000000000)
+    write(templates / 'part.html', '<p>Part</p>', 1000000000)
+    write(templates / 'page.html',
+          '{% extends "base.html" %}{% block body %}{% include "part.html" %}{% endblock %}', 1000000000)
+    r = client.get('/journal/page.html')
+    assert r.status_code == 200
+    assert r.data == b'<p>Old</p><p>Part</p>'
+    etag = r.headers['ETag']
+    assert client.get('/journal/page.html', headers={'If-None-Match': etag}).status_code == 304
+
+    write(templates / 'base.html', '<p>New</p>{% block body %}{% endblock %}', 1000000100)
+    r = client.get('/journal/page.html', headers={'If-None-Match': etag})
+    assert r.status_code == 200
+    assert r.data == b'<p>New</p><p>Part</p>'
+    assert r.headers['ETag'] != etag
+    etag = r.headers['ETag']
+
+    write(templates / 'part.html', '<p>Changed part</p>', 1000000200)
+    r = client.get('/journal/page.html', headers={'If-None-Match': etag})
+    assert r.status_code == 200
+    assert r.data == b'<p>New</p><p>Changed part</p>'
+
+def test_template_sources_read_once(templates, client, monkeypatch):
+    write(templates / 'base.html', '<p>Base</p>{% block body %}{% endblock %}', 1000000000)
+    write(templates / 'page.html', '{% extends "base.html" %}{% block body %}Page{% endblock %}', 1000000000)
+    loader = cvu.app.jinja_loader
+    reads = []
+    def get_source(env, name):
+        reads.append(name)
+        return jinja2.FileSystemLoader.get_source(loader, env, name)
+    monkeypatch.setattr(loader, 'get_source', get_source)
+    assert client.get('/journal/page.html').data == b'<p>Base</p>Page'
+    assert sorted(set(reads)) == ['base.html', 'page.html']
+    reads.clear()
+    assert client.get('/journal/page.html').data == b'<p>Base</p>Page'
+    assert reads == []
+    # Only the changed template is read again.
+    write(templates / 'base.html', '<p>New</p>{% block body %}{% endblock %}', 1000000100)
+    assert client.get('/journal/page.html').data == b'<p>New</p>Page'
+    assert set(reads) == {'base.html'}
+    # A removed template is found to be gone.
+    (templates / 'page.html').unlink()
+    assert client.get('/journal/page.html').status_code == 404
+
+def test_template_info_bounded():
+    cache = cvu.RenderCache(1 << 20, max_templates=2)
+    def source(text):
+        return lambda: text
+    for i in range(3):
+        assert cache.template_info(('t{}.html'.format(i), i, 1), source('<p>Static</p>'), cvu.app.jinja_env) == (True, (), False)
+    assert list(cache.templates) == [('t1.html', 1, 1), ('t2.html', 2, 1)]
+    cache.template_info(('t1.html', 1, 1), source(''), cvu.app.jinja_env)
+    cache.template_info(('t3.html', 3, 1), source('{% include "t1.html" %}'), cvu.app.jinja_env)
+    assert list(cache.templates) == [('t1.html', 1, 1), ('t3.html', 3, 1)]
+    assert cache.templates[('t3.html', 3, 1)] == (False, ('t1.html',), False)
+    assert cache.template_info(('t4.html', 4, 1), source('{{ session.x }}'), cvu.app.jinja_env)[2]
+    assert not cache.template_info(('t5.html', 5, 1), source('{{ title }}'), cvu.app.jinja_env)[2]
+
+def test_flashes_not_cached(templates, client):
+    write(templates / 'base.html',
+          '{% for m in get_flashed_messages() %}<p>{{ m }}</p>{% endfor %}{% block body %}{% endblock %}',
+          1000000000)
+    write(templates / 'page.html', '{% extends "base.html" %}{% block body %}Page{% endblock %}', 1000000000)
+    r = client.get('/journal/page.html')
+    assert r.data == b'Page'
+    etag = r.headers['ETag']
+    with client.session_transaction() as session:
+        session['_flashes'] = [('message', 'Hello')]
+    # A conditional GET doesn't lose the flashed message.
+    r = client.get('/journal/page.html', headers={'If-None-Match': etag})
+    assert r.status_code == 200
+    assert r.data == b'<p>Hello</p>Page'
+    assert 'ETag' not in r.headers and 'Last-Modified' not in r.headers
+    assert client.get('/journal/page.html', headers={'If-None-Match': etag}).status_code == 304
+    assert client.get('/journal/page.html').data == b'Page'
+
+def test_request_templates_not_cached(templates, client):
+    write(templates / 'page.html', '<p>{{ request.args.x }}</p>', 1000000000)
+    for x in ('1', '2'):
+        r = client.get('/journal/page.html?x=' + x)
+        assert r.data == '<p>{}</p>'.format(x).encode('utf-8')
+        assert 'ETag' not in r.headers
+    assert len(cvu.render_cache.pages) == 0
+
+def test_metrics(client, monkeypatch):
+    monkeypatch.setattr(cvu, 'metrics_token', '')
+    assert client.get('/metrics', headers={'Authorization': 'Bearer s3cret'}).status_code == 404
+
+    monkeypatch.setattr(cvu, 'metrics_token', 's3cret')
+    for headers in [{}, {'Authorization': 'Bearer wrong'}, {'Authorization': 's3cret'}]:
+        r = client.get('/metrics', headers=headers)
+        assert r.status_code == 401
+        assert r.headers['WWW-Authenticate'] == 'Bearer'
+
+    r = client.get('/metrics', headers={'Authorization': 'Bearer s3cret'})
+    assert r.status_code == 200
+    assert r.headers['Content-Type'] == 'text/plain; version=0.0.4; charset=utf-8'
+    assert r.headers['Cache-Control'] == 'no-store'
+    text = r.data.decode('utf-8')
+    assert '# TYPE cvu_request_seconds histogram\n' in text
+    assert 'cvu_request_seconds_count{route="/metrics",method="GET"} ' in text
+    assert 'cvu_cache_requests_total{cache="render",result="miss"} 0\n' in text
+
+def test_precompressed(templates, client):
+    page = templates / 'page.html'
+    write(page, '<p>Page</p>', 1000000000)
+    write(templates / 'page.html.gz', 'gzipped', 1000000000)
+    write(templates / 'page.html.br', 'brotli', 1000000000)
+    for accept, encoding, data in [('gzip, deflate, br', 'br', b'brotli'),
+                                   ('gzip', 'gzip', b'gzipped'),
+                                   ('', None, b'<p>Page</p>')]:
+        r = client.get('/journal/page.html', headers={'Accept-Encoding': accept})
+        assert r.status_code == 200
+        assert r.data == data
+        assert r.headers.get('Content-Encoding') == encoding
+        assert r.mimetype == 'text/html'
+        assert 'Accept-Encoding' in r.vary
+
+    # A variant older than the page is ignored.
+    write(page, '<p>New page</p>', 1000000100)
+    write(templates / 'page.html.gz', 'new gzipped', 1000000200)
+    r = client.get('/journal/page.html', headers={'Accept-Encoding': 'gzip, br'})
+    assert r.headers.get('Content-Encoding') == 'gzip'
+    assert r.data == b'new gzipped'
+    r = client.get('/journal/page.html', headers={'Accept-Encoding': 'br'})
+    assert r.headers.get('Content-Encoding') is None
+    assert r.data == b'<p>New page</p>'
+
+def test_static_type(templates, client):
+    write(templates / 'style.css', 'p { color: red; }', 1000000000)
+    write(templates / 'style.css.gz', 'gzipped', 1000000000)
+    r = client.get('/journal/style.css', headers={'Accept-Encoding': 'gzip'})
+    assert r.mimetype == 'text/css'
+    assert r.headers['Content-Encoding'] == 'gzip'
@@ -2,10 +2,18 @@
 # Library code for ACCU website article extraction.
 #
 
+import collections.abc
+import functools
+import gzip
+import hashlib
+import io
 import json
+import os
 import pathlib
 import re
+import sqlite3
 import sys
+import time
 import urllib.parse
 
 # Standard path (URL part after site) generators
@@ -39,8 +47,87 @@ class ConversionError(Exception):
     def __init__(self, msg):
         super().__init__("Conversion error {}".format(msg))
 
+class ConversionProfile:
+    """Call counts and times for the parts of an article conversion.
+
+    Each entry records the number of calls, the cumulative time (including
+    time in nested calls, counting recursive calls once) and the time
+    spent in the call itself, excluding other profiled calls.
+    """
+    def __init__(self):
+        self.stats = {}
+        self.active = collections.Counter()
+        # Time spent in profiled calls nested in each active call.
+        self.nested = [0.0]
+
+    def call(self, name, func, *args):
+        """ Call func(*args), recording the time taken against name."""
+        self.active[name] += 1
+        self.nested.append(0.0)
+        start = time.perf_counter()
+        try:
+            return func(*args)
+        finally:
+            elapsed = time.perf_counter() - start
+            nested = self.nested.pop()
+            self.nested[-1] += elapsed
+            self.active[name] -= 1
+            stat = self.stats.get(name)
+            if stat is None:
+                stat = self.stats[name] = [0, 0.0, 0.0]
+            stat[0] += 1
+            if not self.active[name]:
+                stat[1] += elapsed
+            stat[2] += elapsed - nested
+
+    def merge(self, other):
+        """ Add the figures from another profile to this one."""
+        for name, (calls, cumulative, own) in other.stats.items():
+            stat = self.stats.setdefault(name, [0, 0.0, 0.0])
+            stat[0] += calls
+            stat[1] += cumulative
+            stat[2] += own
+
+    def seconds(self):
+        return sum(stat[2] for stat in self.stats.values())
+
+    def report(self):
+        """ Return the profile as a dict, most expensive entries first."""
+        stats = sorted(self.stats.items(), key=lambda item: item[1][1], reverse=True)
+        return {
+            'seconds': self.seconds(),
+            'calls': { name: { 'calls': calls, 'cumulative': cumulative, 'own': own }
+                       for name, (calls, cumulative, own) in stats }
+            }
+
+def profile_report(profiles):
+    """ Report on (name, ConversionProfile) pairs, one per article.
+
+    Return a dict with the combined profile and the per-article profiles,
+    slowest article first.
+    """
+    total = ConversionProfile()
+    articles = []
+    for name, profile in profiles:
+        total.merge(profile)
+        articles.append((name, profile))
+    articles.sort(key=lambda item: item[1].seconds(), reverse=True)
+    return {
+        'articles': len(articles),
+        'total': total.report(),
+        'by_article': { name: profile.report() for name, profile in articles }
+        }
+
 class BaseOutput:
+    # Set if converting alters the parse tree, so any other formats
+    # must be converted from the tree first.
+    modifies_tree = False
+
     def __init__(self, title, author, summary, includebio):
+        self.reset(title, author, summary, includebio)
+
+    def reset(self, title, author, summary, includebio):
+        """ Clear conversion state, ready to convert a new article."""
         self.title = title
         self.title_filename = article_title_to_filename(title)
         self.author = author
@@ -73,28 +160,142 @@ class BaseOutput:
         else:
             return classname == cl
 
+    # Node types, and what to do with them. Document text is converted
+    # with get_string(). Tags are converted with the handler for the tag
+    # name. Anything else (comments etc.) is ignored. Subclasses of these
+    # types are classified when first seen.
+    NODE_IGNORE, NODE_STRING, NODE_TAG = range(3)
+    node_kinds = {
+        bs4.Tag: NODE_TAG,
+        bs4.NavigableString: NODE_STRING,
+        }
+
+    @classmethod
+    def node_kind(cls, node_type):
+        try:
+            return cls.node_kinds[node_type]
+        except KeyError:
+            pass
+        if issubclass(node_type, (bs4.Comment, bs4.CData, bs4.ProcessingInstruction,
+                                  bs4.Declaration, bs4.Doctype)):
+            kind = cls.NODE_IGNORE
+        elif issubclass(node_type, bs4.NavigableString):
+            kind = cls.NODE_STRING
+        elif issubclass(node_type, bs4.Tag):
+            kind = cls.NODE_TAG
+        else:
+            kind = cls.NODE_IGNORE
+        cls.node_kinds[node_type] = kind
+        return kind
+
+    # Tag handlers are methods named after the tag, listed in the
+    # tag_methods of the class defining them, or functions added with
+    # register_tag(). Nothing else handles a tag, so a tag can't call
+    # any other method. Each output class has its own table mapping tag
+    # names to handlers, filled in as tags are first seen.
+    tag_methods = ('xml', 'html', 'body', 'div')
+    registered_tags = {}
+    tag_dispatch = {}
+
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        cls.registered_tags = {}
+        cls.tag_dispatch = {}
+
+    @classmethod
+    def tag_handler(cls, tag_name):
+        """ Find the handler function for a tag name."""
+        try:
+            return cls.tag_dispatch[tag_name]
+        except KeyError:
+            pass
+        handler = cls.unknown_tag
+        if tag_name == '[document]':
+            handler = cls.document_root
+        else:
+            # The most derived class registering or listing the tag wins.
+            for c in cls.__mro__:
+                registered = c.__dict__.get('registered_tags', {})
+                if tag_name in registered:
+                    handler = registered[tag_name]
+                    break
+                if tag_name in c.__dict__.get('tag_methods', ()):
+                    handler = getattr(cls, tag_name)
+                    break
+        cls.tag_dispatch[tag_name] = handler
+        return handler
+
+    @classmethod
+    def register_tag(cls, tag_name, handler):
+        """ Add or replace the handler for a tag.
+
+        handler is called as handler(output, tag), and must return a
+        list of output items. It applies to this class and its subclasses,
+        unless they have their own handler for the tag.
+        """
+        cls.registered_tags[tag_name] = handler
+        classes = [cls]
+        while classes:
+            c = classes.pop()
+            c.tag_dispatch.pop(tag_name, None)
+            classes.extend(c.__subclasses__())
+
     def convert(self, soup):
         """ Convert everything below this tag.
 
         Return a list of strings.
         """
-        if isinstance(soup, (bs4.Comment, bs4.CData, bs4.ProcessingInstruction,
-                             bs4.Declaration, bs4.Doctype)):
+        node_type = type(soup)
+        try:
+            kind = self.node_kinds[node_type]
+        except KeyError:
+            kind = self.node_kind(node_type)
+        if kind == self.NODE_TAG:
+            try:
+                handler = self.tag_dispatch[soup.name]
+            except KeyError:
+                handler = self.tag_handler(soup.name)
+            return handler(self, soup)
+        elif kind == self.NODE_STRING:
+            return self.get_string(soup.string)
+        else:
             return []
-        if isinstance(soup, bs4.NavigableString):
+
+    # Methods timed by enable_profile(), besides the tag handlers.
+    profiled_methods = ('get_string',)
+
+    def enable_profile(self, profile):
+        """ Record time spent in each tag handler in a ConversionProfile.
+
+        Profiled methods are replaced on this instance with timed versions.
+        """
+        self.disable_profile()
+        self.profile = profile
+        self.convert = self.profiled_convert
+        for name in self.profiled_methods:
+            setattr(self, name, functools.partial(profile.call, name, getattr(self, name)))
+
+    def disable_profile(self):
+        """ Go back to the unprofiled methods."""
+        for name in ('convert',) + self.profiled_methods:
+            self.__dict__.pop(name, None)
+        self.profile = None
+
+    def profiled_convert(self, soup):
+        """ convert(), timing each tag handler against the tag name."""
+        kind = self.node_kind(type(soup))
+        if kind == self.NODE_TAG:
+            return self.profile.call(soup.name, self.tag_handler(soup.name), self, soup)
+        elif kind == self.NODE_STRING:
             return self.get_string(soup.string)
-        elif isinstance(soup, bs4.Tag):
-            tag_name = soup.name
-            if tag_name == '[document]':
-                tag_name = 'document_root'
-            return getattr(self, tag_name, self.unknown_tag)(soup)
         else:
             return []
 
     def convert_children(self, soup):
         res = []
+        convert = self.convert
         for c in soup.children:
-            res.extend(self.convert(c))
+            res.extend(convert(c))
         return res
 
     def get_string(self, s):
@@ -146,20 +347,36 @@ class AdocOutput(BaseOutput):
     def __init__(self, title, author=None, summary=None, includebio=False):
         super().__init__(title, author, summary, includebio)
 
-        self.ul_level = 1
-        self.ol_level = 1
-        self.table_level = -1
         self.table_cell_delim = ['¦', '!']
         self.table_delim_start = ['[separator=¦]\n|===', '!===']
         self.table_delim_end = ['|===', '!===']
+        self.in_biblio_re = re.compile(r'\[.+?\]\s*(?P<ref>.*)')
+        self.tidy_xref_re = re.compile(r'pass:\[\[\](?P<ref><<.*?>>)\]')
+
+    def reset(self, title, author=None, summary=None, includebio=False):
+        super().reset(title, author, summary, includebio)
+        self.ul_level = 1
+        self.ol_level = 1
+        self.table_level = -1
         self.list_item = []
         self.swallow_next_leading_space = False
         self.in_pre = False
         self.in_biblio_ref = False
-        self.in_biblio_re = re.compile(r'\[.+?\]\s*(?P<ref>.*)')
-        self.table_listing_re = re.compile('(?P<prelude>.*)\n\\[separator=¦\\]\n\\|===\n\s*a¦\s+(?P<src>\\[source\\]\n----\n.*?\n----)\s*\n\s*h¦(?P<id>.*?)\n\\|===\n(?P<postlude>.*)', re.DOTALL)
-        self.table_image_re = re.compile('(?P<prelude>.*)\n\\[separator=¦\\]\n\\|===\n\s*a¦\s+image::(?P<img>.*?)\\[\\]\n\s*h¦(?P<id>.*?)\n\\|===\n(?P<postlude>.*)', re.DOTALL)
-        self.tidy_xref_re = re.compile(r'pass:\[\[\](?P<ref><<.*?>>)\]')
+
+    # Text escapes, done in a single pass over the string. 'C++' is
+    # replaced by '{cpp}' before escaping. Most strings need no escaping
+    # at all, so check for that first and return them untouched.
+    escape_table = str.maketrans({
+        '\n': ' ',
+        '[': 'pass:[[]',
+        '+': 'pass:[+]',
+        '`': 'pass:[`]',
+        '_': 'pass:[_]',
+        '^': 'pass:[^]',
+        '~': 'pass:[~]',
+        '*': 'pass:[*]',
+        })
+    escape_needed_re = re.compile(r'[\n\[+`_^~*]')
 
     # Tidy reference IDs. Make sure they don't contain characters other than
     # alphanumeric and _.
@@ -167,21 +384,46 @@ class AdocOutput(BaseOutput):
     def tidy_ref_id(ref):
         return ''.join([c if c.isalnum() or c == '_' else '_' for c in ref])
 
+    # The deferred formatting callables only ever look at the end of the
+    # output so far, to see if it is at a line start, a blank line or a
+    # continuation ('\n+\n'). So rather than pass them the whole output,
+    # pass just the tail, this many characters long.
+    join_tail_len = 3
+
+    profiled_methods = BaseOutput.profiled_methods + ('join_list', 'tidy_adoc')
+
+    tag_methods = ('p', 'blockquote', 'code', 'tt', 'b', 'em', 'u', 'i', 'cite', 'strong',
+                   'sup', 'sub', 'big', 'footer', 'span', 'hr', 'div',
+                   'h1', 'h2', 'h3', 'h4', 'h5', 'h6', 'pre', 'br',
+                   'ul', 'ol', 'li', 'dl', 'dt', 'dd',
+                   'table', 'tr', 'td', 'th', 'colgroup', 'thead', 'tbody', 'a', 'img')
+
     def join_list(self, l):
-        res = ''
+        """ Join a list of strings and deferred formatting callables.
+
+        Callables are given the tail of the output so far, and return
+        the string to insert. This keeps the join linear in the size of
+        the output.
+        """
+        res = []
+        tail = ''
         for item in l:
             if callable(item):
-                res += item(res)
+                item = item(tail)
             elif isinstance(item, str):
                 if self.swallow_next_leading_space:
                     item = item.lstrip()
-                    print(item)
                     if item:
                         self.swallow_next_leading_space = False
-                res += item
             else:
                 raise ConversionError('Unexpected item {}'.format(item))
-        return res
+            if item:
+                res.append(item)
+                if len(item) >= self.join_tail_len:
+                    tail = item[-self.join_tail_len:]
+                else:
+                    tail = (tail + item)[-self.join_tail_len:]
+        return ''.join(res)
 
     def to_line_start(self, s):
         return '' if len(s) == 0 or s.endswith('\n') else '\n'
@@ -223,15 +465,8 @@ class AdocOutput(BaseOutput):
             # This appears to be a regular image bug.
             if s == ' />':
                 s = ''
-            s = s.replace('C++', '{cpp}')
-            s = s.replace('\n', ' ')\
-                .replace('[', 'pass:[[]')\
-                .replace('+', 'pass:[+]')\
-                .replace('`', 'pass:[`]')\
-                .replace('_', 'pass:[_]')\
-                .replace('^', 'pass:[^]')\
-                .replace('~', 'pass:[~]')\
-                .replace('*', 'pass:[*]')
+            elif self.escape_needed_re.search(s):
+                s = s.replace('C++', '{cpp}').translate(self.escape_table)
         # TODO. Prevent character substitution on =>, <=, -> <=>.
         return [s]
 
@@ -378,11 +613,14 @@ class AdocOutput(BaseOutput):
     def h6(self, tag):
         return self.hn(tag, 6)
 
-    def pre(self, tag):
+    def source_block(self, tag):
         self.in_pre = True
         src = self.convert_children(tag)
         self.in_pre = False
-        return self.blank_line_before() + ['[source]\n----\n'] + src + ['\n----\n', self.swallow_leading_space]
+        return ['[source]\n----\n'] + src + ['\n----\n', self.swallow_leading_space]
+
+    def pre(self, tag):
+        return self.blank_line_before() + self.source_block(tag)
 
     def br(self, tag):
         return [' +\n', self.swallow_leading_space] + self.convert_children(tag)
@@ -421,7 +659,86 @@ class AdocOutput(BaseOutput):
         dd = self.strip_para_start(self.convert_children(tag))
         return [self.to_line_start] + dd
 
+    def child_tags(self, tag):
+        """ Return the child tags of tag, or None if it also holds text."""
+        res = []
+        for c in tag.children:
+            kind = self.node_kind(type(c))
+            if kind == self.NODE_TAG:
+                res.append(c)
+            elif kind == self.NODE_STRING and c.strip():
+                return None
+        return res
+
+    def captioned_table(self, tag):
+        """ Recognise a table used to give a listing or image a title.
+
+        These tables have just two cells, the first holding only a <pre>
+        or an <img>, perhaps in a paragraph, and the second a title cell.
+        Return the listing or image tag and the title cell, or None.
+        Only the table structure is looked at, and the table is given up
+        on as soon as it has more than two cells, so this takes time
+        linear in the size of the table at worst.
+        """
+        if self.table_level >= 0 or self.has_class(tag, 'sidebartable'):
+            return None
+        parts = self.child_tags(tag)
+        if parts is None:
+            return None
+        rows = []
+        for part in parts:
+            if part.name in ('thead', 'tbody', 'tfoot'):
+                inner = self.child_tags(part)
+                if inner is None or any(row.name != 'tr' for row in inner):
+                    return None
+                rows.extend(inner)
+            elif part.name == 'tr':
+                rows.append(part)
+            elif part.name != 'colgroup':
+                return None
+        cells = []
+        for row in rows:
+            row_cells = self.child_tags(row)
+            if row_cells is None or len(cells) + len(row_cells) > 2:
+                return None
+            cells.extend(row_cells)
+        if len(cells) != 2:
+            return None
+        body, title = cells
+        if body.name != 'td' or self.has_class(body, 'title') or body.has_attr('colspan'):
+            return None
+        if not (title.name == 'th' or (title.name == 'td' and self.has_class(title, 'title'))) or \
+           title.has_attr('colspan'):
+            return None
+        if not title.get_text().strip():
+            return None
+        content = self.child_tags(body)
+        while content and len(content) == 1 and content[0].name == 'p' and not content[0].get('class'):
+            content = self.child_tags(content[0])
+        if not content or len(content) != 1 or content[0].name not in ('pre', 'img'):
+            return None
+        return content[0], title
+
+    @staticmethod
+    def image_alt(text):
+        """ Make text usable as image macro alt text."""
+        alt = ' '.join(text.split()).replace(']', '\\]')
+        if any(c in alt for c in ',="'):
+            alt = '"{}"'.format(alt.replace('"', '\\"'))
+        return alt
+
     def table(self, tag):
+        captioned = self.captioned_table(tag)
+        if captioned:
+            content, title_cell = captioned
+            title = ' '.join(self.join_list(self.convert_children(title_cell)).split())
+            res = self.blank_line_before() + ['.{title}\n'.format(title=title)]
+            if content.name == 'pre':
+                return res + self.source_block(content)
+            src = self.imgpath(content.get('src'))
+            return res + ['image::{src}[{alt}]\n'.format(src=src, alt=self.image_alt(title_cell.get_text())),
+                          self.swallow_leading_space]
+
         self.table_level += 1
         if self.table_level >= len(self.table_cell_delim):
             raise ConversionError('Sorry, I can\'t nest tables deeper than {}'.format(self.table_level))
@@ -436,25 +753,6 @@ class AdocOutput(BaseOutput):
         else:
             res = res + [self.to_line_start, '{}\n'.format(self.table_delim_end[self.table_level]), self.swallow_leading_space]
         self.table_level -= 1
-
-        return res
-        # Look out for particular table formations and replace with
-        # more appropriate markup.
-        s = self.join_list(res)
-        match = self.table_listing_re.fullmatch(s)
-        if match:
-            return [ '{prelude}\n.{id}\n{src}\n{postlude}'.format(
-                prelude=match.group('prelude'),
-                src=match.group('src'),
-                id=match.group('id'),
-                postlude=match.group('postlude')) ]
-        match = self.table_image_re.fullmatch(s)
-        if match:
-            return [ '{prelude}\n.{id}\nimage::{img}[{id}]\n{postlude}'.format(
-                prelude=match.group('prelude'),
-                img=self.imgpath(match.group('img')),
-                id=match.group('id'),
-                postlude=match.group('postlude')) ]
         return res
 
     def tr(self, tag):
@@ -530,9 +828,13 @@ class AdocOutput(BaseOutput):
         return self.tidy_adoc(self.join_list(res))
 
 class HtmlOutput(BaseOutput):
+    # Image sources are rewritten, and bios emptied, in the tree.
+    modifies_tree = True
+
+    tag_methods = ('p', 'img')
+
     def __init__(self, title, author=None, summary=None, includebio=False):
         super().__init__(title, author, summary, includebio)
-        self.bio = None
 
     def unknown_tag(self, tag):
         for t in tag.find_all('img'):
@@ -563,8 +865,334 @@ class HtmlOutput(BaseOutput):
             body = body + ['\n\n<div class="article-bio"><p>'] + [self.bio] + ['</p></div>\n\n']
         return '<div class="article-content">\n' + ''.join(body) + '</div>\n'
 
+# Direct lxml tree backend. These classes wrap an lxml element tree in
+# the parts of the BeautifulSoup interface the output classes use, and
+# behave as the BeautifulSoup lxml builders would for the same input:
+# whitespace-only strings are collapsed, HTML multi-valued attributes
+# are split, and prettify() gives the same layout.
+from lxml import etree
+
+ascii_spaces = '\x20\x0a\x09\x0c\x0d'
+
+class LxmlBuilderInfo:
+    """ The tree builder properties of a BeautifulSoup builder."""
+    def __init__(self, features):
+        builder = bs4.builder.builder_registry.lookup(features)()
+        self.is_xml = builder.is_xml
+        self.empty_element_tags = builder.empty_element_tags
+        self.preserve_whitespace_tags = builder.preserve_whitespace_tags or set()
+        self.cdata_list_attributes = builder.cdata_list_attributes or {}
+        self.cdata_containing_tags = set() if self.is_xml else {'script', 'style'}
+        self.pi_suffix = '?>' if self.is_xml else '>'
+
+    def is_cdata_list_attribute(self, tag_name, attr):
+        return attr in self.cdata_list_attributes.get('*', ()) or \
+            attr in self.cdata_list_attributes.get(tag_name, ())
+
+lxml_builders = {
+    'html': LxmlBuilderInfo('lxml'),
+    'xml': LxmlBuilderInfo('lxml-xml'),
+    }
+
+class LxmlString(str):
+    """ A string in the tree, like a bs4 NavigableString."""
+    __slots__ = ()
+
+    @property
+    def string(self):
+        return self
+
+class LxmlIgnored(str):
+    """ A comment or processing instruction, kept only for prettify()."""
+    __slots__ = ('markup',)
+
+    @property
+    def string(self):
+        return self
+
+class LxmlTag:
+    """ An lxml element, with the bs4 Tag interface used by the converters."""
+    __slots__ = ('element', 'builder')
+
+    def __init__(self, element, builder):
+        self.element = element
+        self.builder = builder
+
+    @property
+    def name(self):
+        return self.element.tag
+
+    def wrap(self, node):
+        if isinstance(node.tag, str):
+            return LxmlTag(node, self.builder)
+        if node.tag is etree.Comment:
+            res = LxmlIgnored(node.text or '')
+            res.markup = '<!--' + res + '-->'
+        else:
+            res = LxmlIgnored(node.target + ' ' + (node.text or ''))
+            res.markup = '<?' + res + self.builder.pi_suffix
+        return res
+
+    def preserves_whitespace(self):
+        preserve = self.builder.preserve_whitespace_tags
+        if not preserve:
+            return False
+        if self.element.tag in preserve:
+            return True
+        return any(a.tag in preserve for a in self.element.iterancestors())
+
+    def make_string(self, s):
+        if not s.strip(ascii_spaces) and s and not self.preserves_whitespace():
+            s = '\n' if '\n' in s else ' '
+        return LxmlString(s)
+
+    @property
+    def children(self):
+        element = self.element
+        if element.text is not None:
+            yield self.make_string(element.text)
+        for child in element:
+            if isinstance(child.tag, str) or child.tag in (etree.Comment, etree.PI):
+                yield self.wrap(child)
+            if child.tail:
+                yield self.make_string(child.tail)
+
+    @property
+    def string(self):
+        children = list(self.children)
+        if len(children) != 1:
+            return None
+        return children[0].string
+
+    @string.setter
+    def string(self, s):
+        del self.element[:]
+        self.element.text = s
+
+    def get(self, key, default=None):
+        value = self.element.get(key)
+        if value is None:
+            return default
+        if not self.builder.is_xml and self.builder.is_cdata_list_attribute(self.name, key):
+            return value.split()
+        return value
+
+    def has_attr(self, key):
+        return key in self.element.attrib
+
+    def __getitem__(self, key):
+        value = self.get(key)
+        if value is None:
+            raise KeyError(key)
+        return value
+
+    def __setitem__(self, key, value):
+        self.element.set(key, value)
+
+    def find_all(self, name):
+        return [LxmlTag(e, self.builder) for e in self.element.iterdescendants(name)]
+
+    def get_text(self):
+        res = []
+        for c in self.children:
+            if isinstance(c, LxmlTag):
+                res.append(c.get_text())
+            elif isinstance(c, LxmlString):
+                res.append(c)
+        return ''.join(res)
+
+    @staticmethod
+    def escape(s):
+        return s.replace('&', '&amp;').replace('<', '&lt;').replace('>', '&gt;')
+
+    @classmethod
+    def quote_attribute(cls, value):
+        value = cls.escape(value)
+        if '"' in value:
+            if "'" in value:
+                return '"' + value.replace('"', '&quot;') + '"'
+            return "'" + value + "'"
+        return '"' + value + '"'
+
+    def is_empty_element(self):
+        empty = self.builder.empty_element_tags
+        return (empty is None or self.name in empty) and \
+            self.element.text is None and len(self.element) == 0
+
+    def format_tag(self):
+        attrs = []
+        for key, value in sorted(self.element.attrib.items()):
+            if not self.builder.is_xml and self.builder.is_cdata_list_attribute(self.name, key):
+                value = ' '.join(value.split())
+            attrs.append('{}={}'.format(key, self.quote_attribute(value)))
+        return '<' + ' '.join([self.name] + attrs) + ('/>' if self.is_empty_element() else '>')
+
+    def prettify(self):
+        """ Format the tag as bs4's Tag.prettify() does."""
+        pieces = []
+        self.prettify_into(pieces, 0, False)
+        return ''.join(pieces)
+
+    def prettify_into(self, pieces, level, literal):
+        indent = ' ' * level
+        if self.is_empty_element():
+            pieces.append(self.format_tag() if literal else indent + self.format_tag() + '\n')
+            return
+        enter_literal = not literal and self.name in self.builder.preserve_whitespace_tags
+        if literal:
+            pieces.append(self.format_tag())
+        elif enter_literal:
+            pieces.append(indent + self.format_tag())
+        else:
+            pieces.append(indent + self.format_tag() + '\n')
+        child_literal = literal or enter_literal
+        raw = self.name in self.builder.cdata_containing_tags
+        child_indent = ' ' * (level + 1)
+        for c in self.children:
+            if isinstance(c, LxmlTag):
+                c.prettify_into(pieces, level + 1, child_literal)
+                continue
+            s = c.markup if isinstance(c, LxmlIgnored) else (c if raw else self.escape(c))
+            if child_literal:
+                pieces.append(s)
+            else:
+                s = s.strip()
+                if s:
+                    pieces.append(child_indent + s + '\n')
+        if literal:
+            pieces.append('</' + self.name + '>')
+        elif enter_literal:
+            pieces.append('</' + self.name + '>\n')
+        else:
+            pieces.append(indent + '</' + self.name + '>\n')
+
+class LxmlDocument(LxmlTag):
+    """ The document, holding the root element."""
+    __slots__ = ()
+
+    name = '[document]'
+
+    @property
+    def children(self):
+        yield LxmlTag(self.element, self.builder)
+
+def parse_lxml(source, inputformat):
+    """ Parse input with lxml, returning an LxmlDocument.
+
+    Return None if the input should be left to BeautifulSoup: byte input,
+    whose encoding BeautifulSoup detects, XML with namespaces, and XML
+    that isn't well formed.
+    """
+    if not isinstance(source, str):
+        return None
+    try:
+        if inputformat == 'xml':
+            if 'xmlns' in source:
+                return None
+            root = etree.fromstring(source.encode('utf-8'),
+                                    etree.XMLParser(encoding='utf-8', resolve_entities=False))
+        else:
+            parser = etree.HTMLParser()
+            parser.feed(source)
+            root = parser.close()
+    except (etree.XMLSyntaxError, ValueError):
+        return None
+    if root is None:
+        return None
+    return LxmlDocument(root, lxml_builders[inputformat])
+
+BaseOutput.node_kinds.update({
+    LxmlDocument: BaseOutput.NODE_TAG,
+    LxmlTag: BaseOutput.NODE_TAG,
+    LxmlString: BaseOutput.NODE_STRING,
+    LxmlIgnored: BaseOutput.NODE_IGNORE,
+    })
+
+parsers = {
+    "xml": "lxml-xml",
+    "html": "lxml"
+    }
+backends = ('bs4', 'lxml')
+
+def parse_article(source, inputformat, backend='bs4'):
+    """ Parse article input with the given backend.
+
+    The lxml backend falls back to BeautifulSoup for input it can't take.
+    """
+    if backend == 'lxml':
+        if hasattr(source, 'read'):
+            source = source.read()
+        doc = parse_lxml(source, inputformat)
+        if doc is not None:
+            return doc
+    return bs4.BeautifulSoup(source, parsers[inputformat])
+
 # Helper functions for standard conversions.
-def convert_article(source, inputformat, outputformat, title, author, summary, imagedir='', includebio=False):
+output_classes = {
+    "adoc": AdocOutput,
+    "html": HtmlOutput
+    }
+
+class ArticleConverter:
+    """Convert articles to any set of output formats, parsing each once.
+
+    The output object for a format is made when the format is first
+    asked for, and reset for each following article, so a converter can
+    be reused across a batch of articles.
+    """
+    def __init__(self, inputformat, backend='bs4'):
+        if inputformat not in parsers:
+            raise ConversionError('inputformat must be "xml" or "html"')
+        if backend not in backends:
+            raise ConversionError('backend must be "bs4" or "lxml"')
+        self.inputformat = inputformat
+        self.backend = backend
+        self.outputs = {}
+
+    def output(self, outputformat, title, author, summary, includebio):
+        """ Return the output object for a format, ready for a new article."""
+        out = self.outputs.get(outputformat)
+        if out is None:
+            try:
+                cls = output_classes[outputformat]
+            except KeyError:
+                raise ConversionError('outputformat must be "adoc" or "html"')
+            out = self.outputs[outputformat] = cls(title, author, summary, includebio)
+        else:
+            out.reset(title, author, summary, includebio)
+        return out
+
+    def convert(self, source, outputformats, title, author, summary, imagedir='', includebio=False, profile=None):
+        """Convert article input to each of outputformats.
+
+           imagedir: image directory, or a dict giving the image
+           directory for each format.
+
+           returns dict of format to tuple of converted text and list
+           of image renames."""
+        outputs = [(fmt, self.output(fmt, title, author, summary, includebio))
+                   for fmt in dict.fromkeys(outputformats)]
+        # Formats that alter the tree go last.
+        outputs.sort(key=lambda item: item[1].modifies_tree)
+        if profile is None:
+            for fmt, out in outputs:
+                out.disable_profile()
+            soup = parse_article(source, self.inputformat, self.backend)
+        else:
+            for fmt, out in outputs:
+                out.enable_profile(profile)
+            soup = profile.call('parse', parse_article, source, self.inputformat, self.backend)
+        res = {}
+        for fmt, out in outputs:
+            if profile is None:
+                text = out.convert_document(soup)
+            else:
+                text = profile.call('convert_document', out.convert_document, soup)
+            basedir = imagedir.get(fmt, '') if isinstance(imagedir, dict) else imagedir
+            res[fmt] = (text, out.image_renames(basedir))
+        return res
+
+def convert_article(source, inputformat, outputformat, title, author, summary, imagedir='', includebio=False, profile=None, backend='bs4'):
     """convert XML or HTML article input to adoc or HTML.
 
        source: input data - file or string.
@@ -572,30 +1200,14 @@ def convert_article(source, inputformat, outputformat, title, author, summary, i
        outputformat: 'adoc' or 'html'.
        title: article title
        author: article author
+       profile: if not None, a ConversionProfile to record timings in.
+       backend: parser, 'bs4' (BeautifulSoup) or 'lxml'.
 
        returns tuple of converted text and list of image renames.
 
        throws ConversionError."""
-    parsers = {
-        "xml": "lxml-xml",
-        "html": "lxml"
-        }
-    outputs = {
-        "adoc": AdocOutput(title=title, author=author, summary=summary, includebio=includebio),
-        "html": HtmlOutput(title=title, author=author, summary=summary, includebio=includebio)
-    }
-
-    try:
-        infmt = parsers[inputformat]
-    except KeyError:
-        raise ConversionError('inputformat must be "xml" or "html"')
-    try:
-        outfmt = outputs[outputformat]
-    except KeyError:
-        raise ConversionError('outputformat must be "adoc" or "html"')
-
-    soup = bs4.BeautifulSoup(source, infmt)
-    return (outfmt.convert_document(soup), outfmt.image_renames(imagedir))
+    converter = ArticleConverter(inputformat, backend)
+    return converter.convert(source, [outputformat], title, author, summary, imagedir, includebio, profile)[outputformat]
 
 # Bibliography stuff
 class BibSyntaxError(Exception):
@@ -612,11 +1224,85 @@ class BibSyntaxError(Exception):
         self.line = line
         self.message = message
 
-def readbib(f, volume=None, number=None):
-    articles = []
-    in_article = False
+class BibEntry(collections.abc.MutableMapping):
+    """A single bib file entry.
+
+    This behaves as a dict of field name to value, except that 'Author'
+    is always present, and is a list of authors. The usual fields are
+    stored in slots, to keep down the size of a whole bib in memory.
+    Any other fields go in a dict. Fields iterate in the order of
+    'fields' below, followed by any others in the order they were added.
+    """
+
+    fields = ('Id', 'Title', 'Author', 'Note', 'Journal', 'Month', 'Year',
+              'Volume', 'Number', 'Pages', 'URL', 'PDF',
+              'CategoryID', 'CategoryName')
+    __slots__ = fields + ('extra',)
+
+    def __init__(self, *args, **kwargs):
+        self.Author = []
+        self.extra = None
+        self.update(*args, **kwargs)
+
+    def __getitem__(self, key):
+        if key in self.fields:
+            try:
+                return getattr(self, key)
+            except AttributeError:
+                raise KeyError(key) from None
+        if self.extra is None:
+            raise KeyError(key)
+        return self.extra[key]
+
+    def __setitem__(self, key, val):
+        if key in self.fields:
+            setattr(self, key, val)
+        else:
+            if self.extra is None:
+                self.extra = {}
+            self.extra[key] = val
+
+    def __delitem__(self, key):
+        if key in self.fields:
+            try:
+                delattr(self, key)
+            except AttributeError:
+                raise KeyError(key) from None
+        elif self.extra is None:
+            raise KeyError(key)
+        else:
+            del self.extra[key]
+
+    def __iter__(self):
+        for key in self.fields:
+            if hasattr(self, key):
+                yield key
+        if self.extra:
+            yield from self.extra
+
+    def __len__(self):
+        return sum(1 for key in self)
+
+    def __repr__(self):
+        return 'BibEntry({!r})'.format(dict(self.items()))
+
+def iterbib(f, volume=None, number=None):
+    """Read bib entries from file f, yielding each BibEntry as it is read.
+
+    If volume or number are given, only entries with that Volume or
+    Number are returned. The rest of the file is still checked for
+    errors.
+
+    throws BibSyntaxError."""
+    filters = {}
+    if volume:
+        filters['Volume'] = volume
+    if number:
+        filters['Number'] = number
+    article = None
+    wanted = False
     line_no = 0
-    for l in f.readlines():
+    for l in f:
         line_no = line_no + 1
         l = l.strip()
         if not l:
@@ -624,29 +1310,28 @@ def readbib(f, volume=None, number=None):
         if l[0] == '%':
            continue
         if l == '}':
-           if in_article:
-               in_article = False
-               if volume and article['Volume'] != volume:
-                   continue
-               if number and article['Number'] != number:
-                   continue
-               articles.append(article)
+           if article is not None:
+               # Filtered fields must be present.
+               if wanted and all(key in article for key in filters):
+                   yield article
+               article = None
                continue
            else:
                raise BibSyntaxError(line_no, l, "'}' outside article definition")
         if l == '@Article{':
-            if not in_article:
-                in_article = True
-                article = {}
-                article['Author'] = []
+            if article is None:
+                article = BibEntry()
+                wanted = True
                 continue
             else:
                 raise BibSyntaxError(line_no, l, "'@Article{' inside article definition")
 
-        if not in_article:
+        if article is None:
             raise BibSyntaxError(line_no, l, "Not in article definition")
 
-        key, val = l.split('=', 1)
+        key, sep, val = l.partition('=')
+        if not sep:
+            raise BibSyntaxError(line_no, l, "Expected key=value")
         val = val.strip()
         if key == 'Author':
             article[key].append(val)
@@ -654,56 +1339,473 @@ def readbib(f, volume=None, number=None):
             raise BibSyntaxError(line_no, l, "Value already specified")
         else:
             article[key] = val
-    if in_article:
+            if key in filters and val != filters[key]:
+                wanted = False
+    if article is not None:
         raise BibSyntaxError(line_no + 1, "", "End of file inside article")
-    return articles
+
+def readbib(f, volume=None, number=None):
+    """Read a bib file, returning a list of BibEntry.
+
+    throws BibSyntaxError."""
+    return list(iterbib(f, volume, number))
+
+class BibIndex:
+    """Index of bib entries for finding the entry for an article.
+
+    An entry matches article metadata if it has the same Id, or the
+    same Journal, Year, Month and Title. If several entries match, the
+    first in the bib wins.
+    """
+
+    key_fields = ('Journal', 'Year', 'Month', 'Title')
+
+    def __init__(self, bib):
+        self.bib = bib
+        self.by_id = {}
+        self.by_key = {}
+        for pos in range(len(bib)):
+            self.add(pos)
+
+    @classmethod
+    def entry_key(cls, entry):
+        try:
+            return tuple(entry[f] for f in cls.key_fields)
+        except KeyError:
+            return None
+
+    @staticmethod
+    def index_first(index, key, pos):
+        if key not in index or index[key] > pos:
+            index[key] = pos
+
+    def add(self, pos):
+        """Index the bib entry at pos. Re-add an entry if it changes."""
+        entry = self.bib[pos]
+        if 'Id' in entry:
+            self.index_first(self.by_id, entry['Id'], pos)
+        key = self.entry_key(entry)
+        if key:
+            self.index_first(self.by_key, key, pos)
+
+    def append(self, entry):
+        self.bib.append(entry)
+        self.add(len(self.bib) - 1)
+
+    def find_index(self, metadata):
+        """Return the position of the bib entry for metadata, or None."""
+        found = []
+        if 'Id' in metadata and metadata['Id'] in self.by_id:
+            found.append(self.by_id[metadata['Id']])
+        key = self.entry_key(metadata)
+        if key and key in self.by_key:
+            found.append(self.by_key[key])
+        return min(found) if found else None
+
+    def find(self, metadata):
+        """Return the bib entry for metadata, or None."""
+        pos = self.find_index(metadata)
+        return None if pos is None else self.bib[pos]
+
+class BibCatalogue:
+    """SQLite catalogue of bib files.
+
+    Bib files are parsed once into an indexed database, and reparsed
+    only when they change. Entries can then be queried without reading
+    the bib files again. Entries are returned as BibEntry, in the
+    order they appear in their bib file unless sorted.
+    """
+
+    schema = """
+        CREATE TABLE IF NOT EXISTS sources (
+            path TEXT PRIMARY KEY,
+            mtime INTEGER NOT NULL,
+            size INTEGER NOT NULL,
+            hash TEXT NOT NULL);
+        CREATE TABLE IF NOT EXISTS entries (
+            source TEXT NOT NULL,
+            pos INTEGER NOT NULL,
+            id TEXT,
+            journal TEXT,
+            year TEXT,
+            month TEXT,
+            volume TEXT,
+            number TEXT,
+            title TEXT,
+            author TEXT,
+            data TEXT NOT NULL,
+            PRIMARY KEY (source, pos));
+        CREATE TABLE IF NOT EXISTS authors (
+            source TEXT NOT NULL,
+            pos INTEGER NOT NULL,
+            author TEXT NOT NULL);
+        CREATE INDEX IF NOT EXISTS entries_id ON entries (id);
+        CREATE INDEX IF NOT EXISTS entries_issue ON entries (journal, volume, number);
+        CREATE INDEX IF NOT EXISTS entries_key ON entries (journal, year, month, title);
+        CREATE INDEX IF NOT EXISTS entries_author ON entries (author);
+        CREATE INDEX IF NOT EXISTS entries_title ON entries (title);
+        CREATE INDEX IF NOT EXISTS authors_author ON authors (author);
+        """
+
+    sort_columns = {
+        'author': 'author',
+        'title': 'title',
+        }
+
+    def __init__(self, dbfile):
+        self.dbfile = str(dbfile)
+        self.db = sqlite3.connect(self.dbfile)
+        self.db.executescript(self.schema)
+        self.sources = []
+
+    # A catalogue is passed to worker processes by reopening it.
+    def __getstate__(self):
+        return (self.dbfile, self.sources)
+
+    def __setstate__(self, state):
+        self.__init__(state[0])
+        self.sources = state[1]
+
+    def close(self):
+        self.db.close()
+
+    @staticmethod
+    def source_name(path):
+        return str(pathlib.Path(path).resolve())
+
+    def update(self, path, encodings=('utf-8', 'cp1252')):
+        """Add a bib file to the catalogue, or refresh it if it has changed.
+
+        Subsequent queries are restricted to the bib files added. Return
+        True if the bib file was (re)read.
+
+        throws BibSyntaxError."""
+        source = self.source_name(path)
+        if source not in self.sources:
+            self.sources.append(source)
+        st = os.stat(path)
+        row = self.db.execute('SELECT mtime, size, hash FROM sources WHERE path = ?',
+                              (source,)).fetchone()
+        if row and row[0] == st.st_mtime_ns and row[1] == st.st_size:
+            return False
+        data = pathlib.Path(path).read_bytes()
+        digest = hashlib.sha256(data).hexdigest()
+        with self.db:
+            if row and row[2] == digest:
+                self.db.execute('UPDATE sources SET mtime = ?, size = ? WHERE path = ?',
+                                (st.st_mtime_ns, st.st_size, source))
+                return False
+            for encoding in encodings:
+                try:
+                    text = data.decode(encoding)
+                    break
+                except UnicodeDecodeError:
+                    if encoding == encodings[-1]:
+                        raise
+            self.db.execute('DELETE FROM entries WHERE source = ?', (source,))
+            self.db.execute('DELETE FROM authors WHERE source = ?', (source,))
+            for pos, entry in enumerate(iterbib(io.StringIO(text))):
+                authors = entry['Author']
+                self.db.execute('INSERT INTO entries VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                                (source, pos,
+                                 entry.get('Id'), entry.get('Journal'),
+                                 entry.get('Year'), entry.get('Month'),
+                                 entry.get('Volume'), entry.get('Number'),
+                                 entry.get('Title'),
+                                 authors[0] if authors else None,
+                                 json.dumps(dict(entry))))
+                self.db.executemany('INSERT INTO authors VALUES (?, ?, ?)',
+                                    [(source, pos, a) for a in authors])
+            self.db.execute('INSERT OR REPLACE INTO sources VALUES (?, ?, ?, ?)',
+                            (source, st.st_mtime_ns, st.st_size, digest))
+        return True
+
+    def query(self, where, params, order='', limit=None):
+        """Return matching entries from the catalogue's bib files."""
+        if not self.sources:
+            return []
+        conds = ['source IN ({})'.format(','.join('?' * len(self.sources)))] + where
+        sql = 'SELECT data FROM entries WHERE {conds} ORDER BY {order}{fileorder}'.format(
+            conds=' AND '.join(conds),
+            order=order + ', ' if order else '',
+            fileorder='CASE source {} END, pos'.format(
+                ' '.join('WHEN ? THEN {}'.format(i) for i in range(len(self.sources)))))
+        params = self.sources + params + self.sources
+        if limit:
+            sql = sql + ' LIMIT {:d}'.format(limit)
+        return [BibEntry(json.loads(row[0])) for row in self.db.execute(sql, params)]
+
+    def entries(self, journal=None, volume=None, number=None, author=None, sort=None, reverse=False):
+        """Return entries, optionally restricted to an issue or author.
+
+        sort may be 'author' (first author) or 'title'."""
+        where = []
+        params = []
+        for col, val in [('journal', journal), ('volume', volume), ('number', number)]:
+            if val:
+                where.append('{} = ?'.format(col))
+                params.append(val)
+        if author:
+            where.append('EXISTS (SELECT 1 FROM authors a WHERE a.source = entries.source AND a.pos = entries.pos AND a.author = ?)')
+            params.append(author)
+        order = ''
+        if sort:
+            order = '{} {}'.format(self.sort_columns[sort], 'DESC' if reverse else 'ASC')
+        return self.query(where, params, order)
+
+    def find(self, metadata):
+        """Return the bib entry for metadata, or None.
+
+        Matches as BibIndex.find()."""
+        where = []
+        params = []
+        if 'Id' in metadata:
+            where.append('id = ?')
+            params.append(metadata['Id'])
+        key = BibIndex.entry_key(metadata)
+        if key:
+            where.append('(journal = ? AND year = ? AND month = ? AND title = ?)')
+            params.extend(key)
+        if not where:
+            return None
+        res = self.query(['(' + ' OR '.join(where) + ')'], params, limit=1)
+        return res[0] if res else None
 
 # JSON file stuff
+
+# Packed archives hold many JSON items in a single file, one item per
+# line, JSON Lines style. Each line is compressed as a separate gzip
+# member, so the whole file can be read with gzip, but any single item
+# can be read by seeking to its member. A sidecar index file gives the
+# offset and length of the member for each item id.
+PACKED_SUFFIX = '.jsonl.gz'
+PACKED_INDEX_SUFFIX = '.idx'
+
+class PackedArchiveWriter:
+    """Write a packed archive.
+
+    If append, add items to an existing archive. An item replaces any
+    earlier item with the same id, and is only written if it differs.
+    Otherwise the archive is written to a temporary file and replaces
+    any existing archive when closed. If any item was replaced, the
+    archive is rewritten without the replaced members when closed, so
+    reading it sequentially gives each item once. Use as a context
+    manager; if an exception occurs a new archive is discarded.
+    """
+
+    def __init__(self, path, append=False):
+        self.path = pathlib.Path(path)
+        self.index_path = pathlib.Path(str(path) + PACKED_INDEX_SUFFIX)
+        self.index = {}
+        self.existing = None
+        self.replaced = False
+        if append and self.path.exists():
+            self.existing = PackedArchive(self.path)
+            self.index = dict(self.existing.index)
+            self.write_path = self.path
+            self.f = self.path.open('ab')
+        else:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            self.write_path = pathlib.Path(str(path) + '.tmp')
+            self.f = self.write_path.open('wb')
+
+    def add(self, item_id, item):
+        """Add an item. Return True if it was written."""
+        data = (json.dumps(item, ensure_ascii=False, sort_keys=True) + '\n').encode('utf-8')
+        key = str(item_id)
+        if self.existing and key in self.existing.index and \
+           self.existing.read_raw(key) == data:
+            return False
+        member = gzip.compress(data, mtime=0)
+        if key in self.index:
+            self.replaced = True
+        self.index[key] = [self.f.tell(), len(member)]
+        self.f.write(member)
+        return True
+
+    def compact(self):
+        """Copy the current member for each item to a new file, in file order."""
+        tmp_path = pathlib.Path(str(self.path) + '.compact')
+        index = {}
+        with self.write_path.open('rb') as src, tmp_path.open('wb') as dst:
+            for key, (offset, length) in sorted(self.index.items(), key=lambda kv: kv[1][0]):
+                src.seek(offset)
+                index[key] = [dst.tell(), length]
+                dst.write(src.read(length))
+        tmp_path.replace(self.write_path)
+        self.index = index
+
+    def close(self):
+        self.f.close()
+        if self.existing:
+            self.existing.close()
+        if self.replaced:
+            self.compact()
+        if self.write_path != self.path:
+            self.write_path.replace(self.path)
+        tmp_index = pathlib.Path(str(self.index_path) + '.tmp')
+        with tmp_index.open('w') as f:
+            json.dump(self.index, f)
+        tmp_index.replace(self.index_path)
+
+    def discard(self):
+        self.f.close()
+        if self.existing:
+            self.existing.close()
+        if self.write_path != self.path:
+            self.write_path.unlink()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, tb):
+        if exc_type is None or self.write_path == self.path:
+            self.close()
+        else:
+            self.discard()
+
+class PackedArchive:
+    """Read a packed archive, in order or by item id."""
+
+    def __init__(self, path):
+        self.path = pathlib.Path(path)
+        with open(str(path) + PACKED_INDEX_SUFFIX) as f:
+            self.index = json.load(f)
+        self.f = None
+
+    def ids(self):
+        """Return the item ids in the archive, in numeric order if possible."""
+        return sorted(self.index, key=lambda k: (len(k), k) if k.isdigit() else (sys.maxsize, k))
+
+    def read_raw(self, item_id):
+        if self.f is None:
+            self.f = self.path.open('rb')
+        offset, length = self.index[str(item_id)]
+        self.f.seek(offset)
+        return gzip.decompress(self.f.read(length))
+
+    def get(self, item_id):
+        """Return the item with the given id. Raises KeyError if not present."""
+        return json.loads(self.read_raw(item_id))
+
+    def __iter__(self):
+        """Yield (id, item) for all items in id order."""
+        for item_id in self.ids():
+            yield item_id, self.get(item_id)
+
+    def close(self):
+        if self.f is not None:
+            self.f.close()
+            self.f = None
+
+# Names for JSON inputs that may be in packed archives. A name is either
+# a JSON file name, or '<archive>#<id>' for an item in a packed archive.
+def is_packed(fname):
+    return str(fname).endswith(PACKED_SUFFIX)
+
+def expand_json_inputs(fnames):
+    """Replace any packed archive in a list of JSON input names with names for its items."""
+    res = []
+    for fname in fnames:
+        if is_packed(fname):
+            archive = PackedArchive(fname)
+            res.extend(['{}#{}'.format(fname, item_id) for item_id in archive.ids()])
+        else:
+            res.append(fname)
+    return res
+
+open_archives = {}
+
+def open_archive(archive_name):
+    """Return a PackedArchive for archive_name, opening it on first use."""
+    if archive_name not in open_archives:
+        open_archives[archive_name] = PackedArchive(archive_name)
+    return open_archives[archive_name]
+
+def load_json_input(fname):
+    """Return the JSON data for a JSON input name."""
+    archive_name, sep, item_id = str(fname).rpartition('#')
+    if sep and is_packed(archive_name):
+        return open_archive(archive_name).get(item_id)
+    with open(fname) as f:
+        return json.load(f)
+
+def json_input_exists(fname):
+    archive_name, sep, item_id = str(fname).rpartition('#')
+    if sep and is_packed(archive_name):
+        try:
+            return item_id in open_archive(archive_name).index
+        except FileNotFoundError:
+            return False
+    return pathlib.Path(fname).exists()
+
+# Article JSON parsing tables.
+journal_re = re.compile(r'(?P<name>\w+)\s*Journal.*\- (?P<month>.*)\s*(?P<year>\d{4})')
+issue_re = re.compile(r'o?\d+')
+month_abbrev = {
+    'Jan': 'January',
+    'Feb': 'February',
+    'Mar': 'March',
+    'Apr': 'April',
+    'May': 'May',
+    'Jun': 'June',
+    'Jul': 'July',
+    'Aug': 'August',
+    'Sep': 'September',
+    'Oct': 'October',
+    'Nov': 'November',
+    'Dec': 'December'
+    }
+id_fixups = {
+    # Overload test issue 1
+    1805: ('Overload', '2013', 'July'),
+    1806: ('Overload', '2013', 'July'),
+    1807: ('Overload', '2013', 'July'),
+    1808: ('Overload', '2013', 'July'),
+
+    # Overload test issue 2
+    1821: ('Overload', '2014', 'January'),
+    1822: ('Overload', '2014', 'January'),
+    1823: ('Overload', '2014', 'January'),
+
+    # Article in Overload April 2010
+    1623: ('Overload', '2010', 'April'),
+    }
+
 def read_json(f, bib_author_name_format=False):
-    journal_re = re.compile(r'(?P<name>\w+)\s*Journal.*\- (?P<month>.*)\s*(?P<year>\d{4})')
-    issue_re = re.compile(r'o?\d+')
-    month_abbrev = {
-        'Jan': 'January',
-        'Feb': 'February',
-        'Mar': 'March',
-        'Apr': 'April',
-        'May': 'May',
-        'Jun': 'June',
-        'Jul': 'July',
-        'Aug': 'August',
-        'Sep': 'September',
-        'Oct': 'October',
-        'Nov': 'November',
-        'Dec': 'December'
-        }
-    id_fixups = {
-        # Overload test issue 1
-        1805: ('Overload', '2013', 'July'),
-        1806: ('Overload', '2013', 'July'),
-        1807: ('Overload', '2013', 'July'),
-        1808: ('Overload', '2013', 'July'),
-
-        # Overload test issue 2
-        1821: ('Overload', '2014', 'January'),
-        1822: ('Overload', '2014', 'January'),
-        1823: ('Overload', '2014', 'January'),
-
-        # Article in Overload April 2010
-        1623: ('Overload', '2010', 'April'),
-        }
-    article = json.load(f)
+    """Read article JSON from file f, and return article metadata and body."""
+    return read_article(json.load(f), bib_author_name_format)
+
+def read_json_metadata(fnames, bib_author_name_format=False):
+    """Read metadata from many JSON inputs.
+
+    fnames may include packed archives. Yield (name, metadata) for each
+    article, where metadata is as read_metadata()."""
+    for fname in expand_json_inputs(fnames):
+        yield fname, read_metadata(load_json_input(fname), bib_author_name_format)
+
+def read_article(article, bib_author_name_format=False):
+    """Return article metadata and body from article JSON data."""
+    res = read_metadata(article, bib_author_name_format)
+    if 'body' in article:
+        res['Body'] = str(article['body']).replace('\r', '')
+    # Some old summaries are HTML. Don't include them, but prepend to the
+    # body instead. Formatting can be fixed up manually if necessary.
+    if 'summary' in article and article['summary']:
+        if article['summary'][0] == '<':
+            res['Body'] = article['summary'] + '\n' + article['body']
+    return res
+
+def read_metadata(article, bib_author_name_format=False):
+    """Return article metadata from article JSON data, without the body."""
     res = dict()
-    for s in ['id', 'title', 'body', 'date']:
+    for s in ['id', 'title', 'date']:
         if s in article:
             res[s.capitalize()] = str(article[s]).replace('\r', '')
     if res['Title']:
         res['Title'] = res['Title'].replace('\n', ' ')
-    # Some old summaries are HTML. Don't include them, but prepend to the
-    # body instead. Formatting can be fixed up manually if necessary.
     if 'summary' in article and article['summary']:
-        if article['summary'][0] == '<':
-            res['Body'] = article['summary'] + '\n' + article['body']
-        else:
+        if article['summary'][0] != '<':
             res['Note'] = article['summary']
     if not 'Note' in res:
         res['Note'] = ''
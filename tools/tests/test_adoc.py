@@ -1,3 +1,4 @@
+import pytest
 import accuwebsite
 
 adoc_header = """= Title
@@ -145,3 +146,150 @@ def test_table():
 def test_bf():
     res = convert('<p>This is<br> a second line</p>')
     assert res == 'This is +\na second line'
+
+def test_join_list():
+    out = accuwebsite.AdocOutput('Title')
+    res = out.join_list([out.ensure_blank_line, 'a', out.ensure_blank_line,
+                         'b\n', out.to_line_start, out.ensure_blank_line,
+                         'c', out.swallow_leading_space, '  ', ' d',
+                         out.ensure_blank_line_continuation, 'e'])
+    assert res == 'a\n\nb\n\ncd\n+\ne'
+
+def test_long_document(capsys):
+    res = convert('<xml>' + '<p>Text <br/> more</p>' * 2000 + '</xml>')
+    assert res == '\n\n'.join(['Text  +\nmore'] * 2000)
+    assert capsys.readouterr().out == ''
+
+def test_escape():
+    res = convert('<p>a[1] b+c `d` e_f g^h i~j k*l C++11\nm</p>')
+    assert res == 'apass:[[]1] bpass:[+]c pass:[`]dpass:[`] epass:[_]f gpass:[^]h ipass:[~]j kpass:[*]l {cpp}11 m'
+    res = convert('<pre>a[1] C++ x_y</pre>')
+    assert res == '[source]\n----\na[1] C++ x_y\n----\n'
+
+def test_register_tag():
+    class Output(accuwebsite.AdocOutput):
+        pass
+    Output.register_tag('kbd', lambda out, tag: ['kbd:['] + out.convert_children(tag) + [']'])
+    out = Output('Title')
+    soup = accuwebsite.bs4.BeautifulSoup('<p>Press <kbd>Enter</kbd></p>', 'lxml-xml')
+    assert out.join_list(out.convert(soup)) == 'Press kbd:[Enter]'
+    with pytest.raises(accuwebsite.ConversionError):
+        convert('<p>Press <kbd>Enter</kbd></p>')
+    # Registering a handler doesn't replace a method of the same name.
+    Output.register_tag('reset', lambda out, tag: ['reset:['] + out.convert_children(tag) + [']'])
+    out = Output('Title')
+    soup = accuwebsite.bs4.BeautifulSoup('<p>Press <reset>now</reset></p>', 'lxml-xml')
+    assert out.join_list(out.convert(soup)) == 'Press reset:[now]'
+    assert out.reset('Title') is None
+
+def test_register_tag_subclass():
+    class Output(accuwebsite.AdocOutput):
+        tag_methods = ('kbd',)
+
+        def kbd(self, tag):
+            return ['kbd:['] + self.convert_children(tag) + [']']
+    class Derived(Output):
+        pass
+    accuwebsite.AdocOutput.register_tag('var', lambda out, tag: ['var'])
+    try:
+        Output.register_tag('b', lambda out, tag: ['bold'])
+        soup = accuwebsite.bs4.BeautifulSoup('<p><kbd>x</kbd> <b>y</b> <var>z</var></p>', 'lxml-xml')
+        out = Derived('Title')
+        assert out.join_list(out.convert(soup)) == 'kbd:[x] bold var'
+        # A registered handler takes precedence over the tag method.
+        Output.register_tag('kbd', lambda out, tag: ['registered'])
+        Derived.tag_dispatch.clear()
+        assert out.join_list(out.convert(soup)) == 'registered bold var'
+    finally:
+        del accuwebsite.AdocOutput.registered_tags['var']
+        for cls in (accuwebsite.AdocOutput, Output, Derived):
+            cls.tag_dispatch.clear()
+
+@pytest.mark.parametrize('outputformat', ['adoc', 'html'])
+@pytest.mark.parametrize('name', ['convert', 'join_list', 'has_class', 'reset', 'image_renames', 'hn'])
+def test_methods_not_tags(name, outputformat):
+    src = '<p>Text <{name}>x</{name}></p>'.format(name=name)
+    if outputformat == 'adoc':
+        with pytest.raises(accuwebsite.ConversionError):
+            accuwebsite.convert_article(src, 'html', outputformat, 'Title', None, None)
+    else:
+        text, imgs = accuwebsite.convert_article(src, 'html', outputformat, 'Title', None, None)
+        assert '<{}>'.format(name) in text
+
+def test_profile():
+    src = '<p>One <b>two</b></p><div><div><p>three</p></div></div>'
+    res = accuwebsite.convert_article(src, 'html', 'adoc', 'Title', None, None)
+    profile = accuwebsite.ConversionProfile()
+    assert accuwebsite.convert_article(src, 'html', 'adoc', 'Title', None, None, profile=profile) == res
+    calls = profile.report()['calls']
+    assert calls['p']['calls'] == 2
+    assert calls['div']['calls'] == 2
+    assert calls['b']['calls'] == 1
+    assert calls['get_string']['calls'] == 3
+    assert calls['tidy_adoc']['calls'] == 1
+    assert calls['div']['cumulative'] >= calls['div']['own']
+    report = accuwebsite.profile_report([('a', profile), ('b', accuwebsite.ConversionProfile())])
+    assert report['articles'] == 2
+    assert list(report['by_article']) == ['a', 'b']
+    assert report['total']['calls']['p']['calls'] == 2
+
+def test_lxml_backend():
+    src = ('<p class="bio">Bio</p><p>One <b>C++</b> &amp; <a href="#[1]">[1]</a></p>\n  \n'
+           '<pre>x  &lt; y\n  z</pre><!-- note --><table><tr><td colspan="2">a</td></tr></table>'
+           '<p><img src="/content/images/x.png"></p>')
+    for outputformat in ['adoc', 'html']:
+        expected = accuwebsite.convert_article(src, 'html', outputformat, 'Title', 'Author', 'Summary', includebio=True)
+        res = accuwebsite.convert_article(src, 'html', outputformat, 'Title', 'Author', 'Summary', includebio=True,
+                                          backend='lxml')
+        assert res == expected
+    assert isinstance(accuwebsite.parse_article(src, 'html', 'lxml'), accuwebsite.LxmlDocument)
+
+def test_lxml_backend_fallback():
+    # Not well formed, so left to BeautifulSoup.
+    src = '<xml><p>This is<br> a second line</p></xml>'
+    assert isinstance(accuwebsite.parse_article(src, 'xml', 'lxml'), accuwebsite.bs4.BeautifulSoup)
+    res = accuwebsite.convert_article(src, 'xml', 'adoc', 'Title', 'Author', 'Summary', backend='lxml')
+    assert res[0].endswith('This is +\na second line')
+    with pytest.raises(accuwebsite.ConversionError):
+        accuwebsite.convert_article(src, 'xml', 'adoc', 'Title', 'Author', 'Summary', backend='other')
+
+def test_article_converter():
+    src = '<p>One <b>two</b></p><p><img src="/content/images/a.png"></p><p class="bio">Bio</p>'
+    converter = accuwebsite.ArticleConverter('html')
+    assert converter.outputs == {}
+    for title in ['First', 'Second', 'First']:
+        res = converter.convert(src, ['html', 'adoc'], title, 'Author', 'Summary',
+                                { 'adoc': 'a', 'html': 'h' }, includebio=True)
+        assert list(res) == ['adoc', 'html']
+        for outputformat, imagedir in [('adoc', 'a'), ('html', 'h')]:
+            assert res[outputformat] == accuwebsite.convert_article(src, 'html', outputformat, title, 'Author', 'Summary',
+                                                                    imagedir, includebio=True)
+    assert sorted(converter.outputs) == ['adoc', 'html']
+    with pytest.raises(accuwebsite.ConversionError):
+        converter.convert(src, ['pdf'], 'Title', None, None)
+
+def test_listing_table():
+    res = convert('<div><p>Text</p><table><tr><td><pre>int x;\n</pre></td><td class="title">Listing 1</td></tr></table><p>More</p></div>')
+    assert res == 'Text\n\n.Listing 1\n[source]\n----\nint x;\n\n----\n\nMore'
+    res = convert('<table><tbody><tr><td><p><pre>a_b</pre></p></td></tr><tr><th>Listing <b>2</b></th></tr></tbody></table>')
+    assert res == '.Listing **2**\n[source]\n----\na_b\n----\n'
+    res = convert('<ul><li><p>Item</p><table><tr><td><pre>x</pre></td><td class="title">L</td></tr></table></li></ul>')
+    assert res == '* Item\n+\n.L\n[source]\n----\nx\n----\n'
+
+def test_image_table():
+    res = accuwebsite.convert_article('<table><tr><td><img src="/content/images/a.png"/></td></tr>'
+                                      '<tr><td class="title">Figure 1, x=1</td></tr></table>',
+                                      'xml', 'adoc', 'Title', None, None)
+    assert res[0].endswith('.Figure 1, x=1\nimage::title_0.png["Figure 1, x=1"]\n')
+    assert res[1] == ['cp "./content/images/a.png" title_0.png']
+
+def test_plain_two_cell_tables():
+    # Not a title cell, too many cells, sidebar and nested tables stay tables.
+    res = convert('<table><tr><td><pre>x</pre></td><td>T</td></tr></table>')
+    assert res == '[separator=¦]\n|===\n\n a¦\n\n[source]\n----\nx\n----\na¦T\n|===\n'
+    res = convert('<table><tr><td><pre>x</pre></td><td class="title">T</td><td>3</td></tr></table>')
+    assert res.startswith('[separator=¦]\n|===\n')
+    res = convert('<table class="sidebartable"><tr><td><pre>x</pre></td><td class="title">T</td></tr></table>')
+    assert res.startswith('****\n[separator=¦]\n|===\n')
+    res = convert('<table><tr><td><table><tr><td><pre>x</pre></td><td class="title">T</td></tr></table></td></tr></table>')
+    assert '!===' in res
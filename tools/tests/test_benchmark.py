@@ -0,0 +1,163 @@
+"""Conversion throughput benchmarks.
+
+These are slow, so are skipped unless ACCU_BENCHMARK is set. Each case
+converts a large synthetic article with convert_article(), with each
+parser backend, and reports nodes/sec, MB/sec and peak memory. Peak
+memory is as seen by tracemalloc, so doesn't include lxml's own trees.
+If the baseline file has figures for the case, it fails if nodes/sec has
+dropped, or peak memory grown, by more than the threshold fraction.
+
+    ACCU_BENCHMARK=1 python -m pytest tests/test_benchmark.py
+    ACCU_BENCHMARK=update python -m pytest tests/test_benchmark.py
+
+The second form records the results as the new baseline. Timings depend
+on the machine, so record a baseline on the machine the benchmarks are
+run on. Other settings:
+
+    ACCU_BENCHMARK_BASELINE   baseline file (default benchmark_baseline.json here)
+    ACCU_BENCHMARK_THRESHOLD  allowed regression (default 0.2)
+    ACCU_BENCHMARK_REPEAT     timed runs per case, best is used (default 3)
+"""
+
+import json
+import os
+import pathlib
+import time
+import tracemalloc
+
+import bs4
+import pytest
+
+import accuwebsite
+
+benchmark = os.environ.get('ACCU_BENCHMARK')
+baseline_file = pathlib.Path(os.environ.get('ACCU_BENCHMARK_BASELINE',
+                                            pathlib.Path(__file__).with_name('benchmark_baseline.json')))
+threshold = float(os.environ.get('ACCU_BENCHMARK_THRESHOLD', '0.2'))
+repeat = int(os.environ.get('ACCU_BENCHMARK_REPEAT', '3'))
+
+pytestmark = pytest.mark.skipif(not benchmark, reason='set ACCU_BENCHMARK to run benchmarks')
+
+# Synthetic articles.
+def paragraphs(n=5000):
+    return ''.join('<p>Paragraph {i} has <b>bold</b>, <em>emphasis</em>, <code>code_{i}</code>, '
+                   'C++ and [bracketed] text_with_underscores.</p>\n'.format(i=i) for i in range(n))
+
+def nested_lists(n=300, depth=6):
+    def make(level):
+        tag = 'ul' if level % 2 else 'ol'
+        items = []
+        for i in range(3):
+            inner = make(level + 1) if level < depth and i == 1 else ''
+            items.append('<li><p>Item {level}.{i}</p>{inner}</li>'.format(level=level, i=i, inner=inner))
+        return '<{tag}>{items}</{tag}>'.format(tag=tag, items=''.join(items))
+    return ''.join('<p>List {i}</p>\n'.format(i=i) + make(1) for i in range(n))
+
+def tables(n=300, rows=10, cols=4):
+    inner = '<table><tr><td>a</td><td>b</td></tr><tr><td>c</td><td>d</td></tr></table>'
+    def row(r):
+        cells = ''.join('<td><p>Cell {r},{c}</p></td>'.format(r=r, c=c) for c in range(cols - 1))
+        return '<tr>' + cells + '<td>' + inner + '</td></tr>'
+    header = '<tr>' + ''.join('<th>Head {c}</th>'.format(c=c) for c in range(cols)) + '</tr>'
+    body = header + ''.join(row(r) for r in range(rows))
+    return ''.join('<p>Table {i}</p>\n<table>{body}</table>\n'.format(i=i, body=body) for i in range(n))
+
+def listings(n=200, lines=200):
+    code = '\n'.join('    std::vector&lt;int&gt; v{i}{{ {i} }}; // line_{i} [x] *p++'.format(i=i)
+                     for i in range(lines))
+    return ''.join('<p>Listing {i}</p>\n<pre class="programlisting">{code}</pre>\n'.format(i=i, code=code)
+                   for i in range(n))
+
+def bibliography(n=2000):
+    text = ''.join('<p>As shown in <a href="#[{i}]">[{i}]</a>, and <a href="#[{j}]">[{j}]</a>.</p>\n'.format(
+        i=i, j=(i * 7) % n) for i in range(n))
+    refs = ''.join('<p class="bibliomixed"><a id="[{i}]"></a>[{i}]   Author {i}, <em>Title {i}</em>, '
+                   'Publisher, 2020</p>\n'.format(i=i) for i in range(n))
+    return text + '<h2>References</h2>\n' + refs
+
+def images(n=2000):
+    return ''.join('<p>Figure {i}</p>\n<p><img src="images/figure{i}.png" /></p>\n'.format(i=i)
+                   for i in range(n))
+
+cases = {
+    'paragraphs': paragraphs,
+    'nested_lists': nested_lists,
+    'tables': tables,
+    'listings': listings,
+    'bibliography': bibliography,
+    'images': images,
+    }
+
+def count_nodes(source):
+    soup = bs4.BeautifulSoup(source, 'lxml')
+    return sum(1 for n in soup.descendants)
+
+def convert(source, outputformat, backend):
+    return accuwebsite.convert_article(source, 'html', outputformat, 'Title', 'Author', 'Summary', 'images',
+                                       backend=backend)
+
+def measure(source, outputformat, backend):
+    """ Return best time over repeat runs, and peak memory for one run."""
+    best = None
+    for i in range(repeat):
+        start = time.perf_counter()
+        convert(source, outputformat, backend)
+        elapsed = time.perf_counter() - start
+        if best is None or elapsed < best:
+            best = elapsed
+    tracemalloc.start()
+    try:
+        convert(source, outputformat, backend)
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+    return best, peak
+
+def read_baseline():
+    try:
+        with baseline_file.open() as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {}
+
+def write_baseline(name, result):
+    baseline = read_baseline()
+    baseline[name] = result
+    tmp = baseline_file.with_name(baseline_file.name + '.tmp')
+    with tmp.open('w') as f:
+        json.dump(baseline, f, indent=2, sort_keys=True)
+    tmp.replace(baseline_file)
+
+@pytest.mark.parametrize('backend', accuwebsite.backends)
+@pytest.mark.parametrize('outputformat', ['adoc', 'html'])
+@pytest.mark.parametrize('case', sorted(cases))
+def test_benchmark(case, outputformat, backend, capsys, record_property):
+    name = '{}/{}/{}'.format(case, outputformat, backend)
+    source = cases[case]()
+    nodes = count_nodes(source)
+    seconds, peak = measure(source, outputformat, backend)
+    result = {
+        'nodes': nodes,
+        'seconds': seconds,
+        'nodes_per_sec': nodes / seconds,
+        'mb_per_sec': len(source.encode('utf-8')) / seconds / 1e6,
+        'peak_memory': peak,
+        }
+    for k, v in result.items():
+        record_property(k, v)
+    with capsys.disabled():
+        print('\n{name}: {nodes} nodes, {nodes_per_sec:.0f} nodes/sec, {mb_per_sec:.2f} MB/sec, '
+              'peak memory {peak:.1f} MB'.format(name=name, peak=peak / 1e6, **result))
+
+    if benchmark == 'update':
+        write_baseline(name, result)
+        return
+    base = read_baseline().get(name)
+    if base is None:
+        pytest.skip('no baseline for {}'.format(name))
+    assert result['nodes_per_sec'] >= base['nodes_per_sec'] * (1 - threshold), \
+        '{} throughput regressed: {:.0f} nodes/sec, baseline {:.0f}'.format(
+            name, result['nodes_per_sec'], base['nodes_per_sec'])
+    assert result['peak_memory'] <= base['peak_memory'] * (1 + threshold), \
+        '{} peak memory grew: {} bytes, baseline {}'.format(
+            name, result['peak_memory'], base['peak_memory'])
@@ -0,0 +1,145 @@
+import io
+import itertools
+
+import pytest
+
+import accuwebsite
+
+bib_text = """% Test bib
+@Article{
+  Id=1
+  Title=First
+  Author=Bloggs, Fred
+  Journal=CVu
+  Year=2020
+  Month=January
+  Volume=31
+  Number=6
+}
+
+@Article{
+  Title=Second
+  Author=Bloggs, Fred
+  Author=Doe, Jane
+  Journal=CVu
+  Year=2020
+  Month=March
+  Volume=32
+  Number=1
+}
+
+@Article{
+  Id=3
+  Title=Second
+  Journal=CVu
+  Year=2020
+  Month=March
+  Volume=32
+  Number=1
+}
+"""
+
+def readbib(**kwargs):
+    return accuwebsite.readbib(io.StringIO(bib_text), **kwargs)
+
+def test_bibindex_id():
+    index = accuwebsite.BibIndex(readbib())
+    assert index.find({'Id': '1'})['Title'] == 'First'
+    assert index.find({'Id': '3'})['Title'] == 'Second'
+    assert index.find_index({'Id': '3'}) == 2
+    assert index.find({'Id': '4'}) is None
+
+def test_bibindex_key():
+    index = accuwebsite.BibIndex(readbib())
+    md = {'Id': '4', 'Journal': 'CVu', 'Year': '2020', 'Month': 'March', 'Title': 'Second'}
+    assert index.find_index(md) == 1
+    # Earliest match wins, whether by Id or key.
+    md['Id'] = '3'
+    assert index.find_index(md) == 1
+    # Missing keys mean only the Id is used.
+    assert index.find_index({'Id': '3', 'Title': 'First'}) == 2
+
+def test_bibindex_append():
+    index = accuwebsite.BibIndex(readbib())
+    index.append({'Id': '5', 'Title': 'Third'})
+    assert index.find_index({'Id': '5'}) == 3
+    index.bib[1]['Id'] = '6'
+    index.add(1)
+    assert index.find_index({'Id': '6'}) == 1
+
+def test_readbib():
+    bib = readbib()
+    assert len(bib) == 3
+    assert bib[0]['Id'] == '1'
+    assert bib[1]['Author'] == ['Bloggs, Fred', 'Doe, Jane']
+    assert bib[2]['Author'] == []
+    assert 'Id' not in bib[1]
+    assert list(bib[2].keys()) == ['Id', 'Title', 'Author', 'Journal', 'Month', 'Year', 'Volume', 'Number']
+
+def test_readbib_filter():
+    bib = readbib(volume='32')
+    assert [a['Title'] for a in bib] == ['Second', 'Second']
+    bib = readbib(volume='32', number='2')
+    assert bib == []
+    bib = readbib(number='6')
+    assert [a['Id'] for a in bib] == ['1']
+
+def test_iterbib():
+    entries = accuwebsite.iterbib(io.StringIO(bib_text + '@Article{\n'))
+    assert next(entries)['Title'] == 'First'
+    assert len(list(itertools.islice(entries, 2))) == 2
+    with pytest.raises(accuwebsite.BibSyntaxError) as e:
+        next(entries)
+    assert e.value.lineno == 34
+
+def test_readbib_errors():
+    for text, lineno in [('}\n', 1),
+                         ('@Article{\n@Article{\n', 2),
+                         ('\nTitle=x\n', 2),
+                         ('@Article{\nTitle=x\nTitle=y\n}\n', 3),
+                         ('@Article{\nTitle\n}\n', 2),
+                         ('@Article{\nVolume=1\nTitle\n}\n', 3),
+                         # Duplicates are found in entries outside the filter.
+                         ('@Article{\nVolume=1\nTitle=x\nTitle=y\n}\n', 4),
+                         ('@Article{\nTitle=x\nVolume=1\nVolume=2\n}\n', 4)]:
+        with pytest.raises(accuwebsite.BibSyntaxError) as e:
+            accuwebsite.readbib(io.StringIO(text), volume='2')
+        assert e.value.lineno == lineno
+
+def test_bibentry():
+    entry = accuwebsite.BibEntry({'Title': 'T', 'Extra': 'E'})
+    entry['More'] = 'M'
+    assert dict(entry) == {'Title': 'T', 'Author': [], 'Extra': 'E', 'More': 'M'}
+    assert entry.Title == 'T'
+    assert entry.get('Id') is None
+    del entry['Extra']
+    assert 'Extra' not in entry
+    assert not hasattr(entry, '__dict__')
+
+def test_catalogue(tmp_path):
+    bibfile = tmp_path / 'test.bib'
+    bibfile.write_text(bib_text)
+    cat = accuwebsite.BibCatalogue(tmp_path / 'bib.db')
+    assert cat.update(bibfile)
+    assert not cat.update(bibfile)
+    assert cat.entries() == readbib()
+    assert [a['Title'] for a in cat.entries(volume='32', number='1')] == ['Second', 'Second']
+    assert [a.get('Id') for a in cat.entries(sort='title', reverse=True)] == [None, '3', '1']
+    assert [a['Title'] for a in cat.entries(author='Doe, Jane')] == ['Second']
+    assert cat.find({'Id': '3'})['Title'] == 'Second'
+    md = {'Id': '3', 'Journal': 'CVu', 'Year': '2020', 'Month': 'March', 'Title': 'Second'}
+    assert cat.find(md) == readbib()[1]
+    assert cat.find({'Title': 'First'}) is None
+
+    # Changed bib is reread.
+    bibfile.write_text(bib_text.replace('Title=First', 'Title=Changed'))
+    assert cat.update(bibfile)
+    assert cat.find({'Id': '1'})['Title'] == 'Changed'
+    cat.close()
+
+def test_catalogue_no_sources(tmp_path):
+    cat = accuwebsite.BibCatalogue(tmp_path / 'bib.db')
+    assert cat.entries() == []
+    assert cat.entries(volume='32', sort='title') == []
+    assert cat.find({'Id': '3'}) is None
+    cat.close()
@@ -0,0 +1,17 @@
+import pathlib
+import subprocess
+import sys
+
+import pytest
+
+script = pathlib.Path(__file__).parent.parent / 'accu-dump-xar'
+
+@pytest.mark.parametrize('option', ['--connections', '--batch-size'])
+@pytest.mark.parametrize('value, error', [('0', 'must be at least 1'),
+                                          ('-1', 'must be at least 1'),
+                                          ('two', 'invalid int value')])
+def test_counts(option, value, error):
+    res = subprocess.run([sys.executable, str(script), '-p', 'x', '--pubtype', 'all', option, value],
+                         stdout=subprocess.PIPE, stderr=subprocess.PIPE, universal_newlines=True)
+    assert res.returncode == 2
+    assert 'argument {}: {}'.format(option, error) in res.stderr
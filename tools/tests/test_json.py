@@ -0,0 +1,102 @@
+import gzip
+import json
+
+import pytest
+
+import accuwebsite
+
+def write_archive(path, items, append=False):
+    with accuwebsite.PackedArchiveWriter(path, append) as archive:
+        return [archive.add(item['id'], item) for item in items]
+
+def test_packed(tmp_path):
+    path = tmp_path / ('test' + accuwebsite.PACKED_SUFFIX)
+    items = [{'id': i, 'body': 'Body {}'.format(i)} for i in [10, 2, 1]]
+    write_archive(path, items)
+    archive = accuwebsite.PackedArchive(path)
+    assert archive.ids() == ['1', '2', '10']
+    assert archive.get(2) == items[1]
+    assert [item for item_id, item in archive] == [items[2], items[1], items[0]]
+    with pytest.raises(KeyError):
+        archive.get(3)
+    archive.close()
+    # The whole archive is also a JSON Lines gzip file.
+    with gzip.open(path, 'rt') as f:
+        assert [json.loads(l) for l in f] == items
+
+def test_packed_append(tmp_path):
+    path = tmp_path / ('test' + accuwebsite.PACKED_SUFFIX)
+    write_archive(path, [{'id': 1, 'body': 'One'}, {'id': 2, 'body': 'Two'}])
+    written = write_archive(path, [{'id': 1, 'body': 'One'}, {'id': 2, 'body': 'Changed'}, {'id': 3, 'body': 'Three'}], append=True)
+    assert written == [False, True, True]
+    archive = accuwebsite.PackedArchive(path)
+    assert [item['body'] for item_id, item in archive] == ['One', 'Changed', 'Three']
+    archive.close()
+    # The replaced item is dropped from the file, so a sequential read
+    # sees each item once and the archive doesn't grow.
+    with gzip.open(path, 'rt') as f:
+        assert sorted(json.loads(l)['body'] for l in f) == ['Changed', 'One', 'Three']
+    size = path.stat().st_size
+    write_archive(path, [{'id': 2, 'body': 'Changed again'}], append=True)
+    write_archive(path, [{'id': 2, 'body': 'Changed'}], append=True)
+    assert path.stat().st_size == size
+
+def test_packed_discard(tmp_path):
+    path = tmp_path / ('test' + accuwebsite.PACKED_SUFFIX)
+    write_archive(path, [{'id': 1, 'body': 'One'}])
+    with pytest.raises(RuntimeError):
+        with accuwebsite.PackedArchiveWriter(path) as archive:
+            archive.add(2, {'id': 2})
+            raise RuntimeError('Failed')
+    assert accuwebsite.PackedArchive(path).ids() == ['1']
+
+def test_json_inputs(tmp_path):
+    path = tmp_path / ('test' + accuwebsite.PACKED_SUFFIX)
+    write_archive(path, [{'id': 1, 'body': 'One'}, {'id': 2, 'body': 'Two'}])
+    jsonfile = tmp_path / '00003.json'
+    jsonfile.write_text(json.dumps({'id': 3, 'body': 'Three'}))
+    names = accuwebsite.expand_json_inputs([str(path), str(jsonfile)])
+    assert names == [str(path) + '#1', str(path) + '#2', str(jsonfile)]
+    assert [accuwebsite.load_json_input(n)['body'] for n in names] == ['One', 'Two', 'Three']
+    assert accuwebsite.json_input_exists(names[1])
+    assert not accuwebsite.json_input_exists(str(path) + '#4')
+
+article = {
+    'id': 2461,
+    'title': 'Afterwood',
+    'author': 'Chris Oldwood',
+    'body': '<p>The interviewer\r\n slid a pencil</p>',
+    'date': '2018-02-01T16:13:46',
+    'summary': 'Can you code on paper in an interview?',
+    'category-id': ['o143', 'Process'],
+    'category-name': ['Overload Journal #143 - February 2018', 'Process Topics'],
+    }
+
+def test_read_metadata():
+    res = accuwebsite.read_metadata(article, True)
+    assert res == {
+        'Id': '2461',
+        'Title': 'Afterwood',
+        'Date': '2018-02-01T16:13:46',
+        'Note': 'Can you code on paper in an interview?',
+        'Author': 'Oldwood, Chris',
+        'CategoryID': 'Process',
+        'CategoryName': 'Process Topics',
+        'Journal': 'Overload',
+        'Year': '2018',
+        'Month': 'February',
+        }
+    res = accuwebsite.read_article(article)
+    assert res['Body'] == '<p>The interviewer\n slid a pencil</p>'
+    assert res['Author'] == 'Chris Oldwood'
+
+def test_read_metadata_html_summary():
+    html = dict(article, summary='<p>Summary</p>')
+    assert accuwebsite.read_metadata(html)['Note'] == ''
+    assert accuwebsite.read_article(html)['Body'].startswith('<p>Summary</p>\n')
+
+def test_read_json_metadata(tmp_path):
+    path = tmp_path / ('test' + accuwebsite.PACKED_SUFFIX)
+    write_archive(path, [article, dict(article, id=2462)])
+    res = list(accuwebsite.read_json_metadata([str(path)]))
+    assert [(name, md['Id']) for name, md in res] == [(str(path) + '#2461', '2461'), (str(path) + '#2462', '2462')]
@@ -0,0 +1,74 @@
+import json
+import pathlib
+import re
+import subprocess
+import sys
+
+script = pathlib.Path(__file__).parent.parent / 'accu-json-hugo'
+
+bib_entry = """@Article{{
+  Id={i}
+  Title=Title {i}
+  Author=Bloggs, Fred
+  Journal=Overload
+  Month=January
+  Year=2020
+  Volume=1
+  Number={i}
+}}
+"""
+
+def make_inputs(path, n=8, bad=()):
+    path.mkdir()
+    (path / 'bib.txt').write_text(''.join(bib_entry.format(i=i) for i in range(1, n + 1)))
+    names = []
+    for i in range(1, n + 1):
+        body = '<p><foo>Bad</foo></p>' if i in bad else \
+            '<p>Article {i} <img src="/content/images/a{i}.png"/><img src="/content/images/b{i}.png"/></p>'.format(i=i)
+        article = {
+            'id': i,
+            'title': 'Title {}'.format(i),
+            'body': body,
+            'date': '2020-01-01',
+            'summary': 'Summary',
+            'author': 'Fred Bloggs',
+            'category-id': ['o155'],
+            'category-name': ['Overload Journal #155 - January 2020'],
+            }
+        name = 'a{:02}.json'.format(i)
+        (path / name).write_text(json.dumps(article))
+        names.append(name)
+    return names
+
+def json_hugo(cwd, *args):
+    return subprocess.run([sys.executable, str(script), '-j', 'Overload', '--bib', 'bib.txt', '-f', 'adoc'] + list(args),
+                          cwd=str(cwd), stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                          universal_newlines=True)
+
+def test_jobs(tmp_path):
+    names = make_inputs(tmp_path / 'in')
+    results = []
+    for jobs in ('1', '3'):
+        res = json_hugo(tmp_path / 'in', '--jobs', jobs, '-s', 'site' + jobs, '-m', 'manifest' + jobs, *names)
+        assert res.returncode == 0, res.stderr
+        with (tmp_path / 'in' / ('manifest' + jobs)).open() as f:
+            manifest = json.load(f)
+        results.append((res.stdout.replace('site' + jobs, 'site'),
+                        json.dumps(manifest).replace('site' + jobs, 'site')))
+    # Image lines come out in input order, whatever the number of jobs.
+    images = re.findall(r'images/(\w+)\.png', results[0][0])
+    assert images == [img.format(i) for i in range(1, len(names) + 1) for img in ('a{}', 'b{}')]
+    assert results[0] == results[1]
+
+def test_failure(tmp_path):
+    names = make_inputs(tmp_path / 'in', n=4, bad=(2,))
+    (tmp_path / 'in' / 'broken.json').write_text('{')
+    names.insert(1, 'broken.json')
+    for jobs in ('1', '2'):
+        res = json_hugo(tmp_path / 'in', '--jobs', jobs, '-s', 'site', *names)
+        # Failures are reported, and the rest of the batch converted.
+        assert res.returncode == 1
+        assert 'Unknown Tag foo in a02.json' in res.stderr
+        assert 'Failed to convert broken.json' in res.stderr
+        assert len(res.stdout.splitlines()) == 6
+        assert (tmp_path / 'in' / 'a02.json.err.html').exists()
@@ -0,0 +1,57 @@
+import gzip
+import os
+import pathlib
+import subprocess
+import sys
+
+script = pathlib.Path(__file__).parent.parent / 'accu-precompress'
+
+def precompress(*args):
+    res = subprocess.run([sys.executable, str(script), '--no-brotli'] + [str(a) for a in args],
+                         stderr=subprocess.PIPE, universal_newlines=True, check=True)
+    return res.stderr.strip()
+
+def make_site(site):
+    (site / 'journal').mkdir(parents=True)
+    (site / 'index.html').write_text('<p>Index</p>' * 100)
+    (site / 'journal' / 'page.html').write_text('<p>Page</p>' * 100)
+    (site / 'style.css').write_text('p { color: red; }')
+    (site / 'image.png').write_bytes(b'PNG')
+
+def test_precompress(tmp_path):
+    site = tmp_path / 'public'
+    make_site(site)
+    assert precompress(site) == '3 files, 3 variants written'
+    assert gzip.decompress((site / 'journal' / 'page.html.gz').read_bytes()) == b'<p>Page</p>' * 100
+    assert not (site / 'image.png.gz').exists()
+    # Up to date variants are left alone.
+    assert precompress(site) == '3 files, 0 variants written'
+    # A changed file is compressed again.
+    page = site / 'index.html'
+    page.write_text('<p>Changed</p>')
+    st = (site / 'index.html.gz').stat()
+    os.utime(str(page), ns=(st.st_atime_ns, st.st_mtime_ns + 10**9))
+    assert precompress(site) == '3 files, 1 variants written'
+    assert gzip.decompress((site / 'index.html.gz').read_bytes()) == b'<p>Changed</p>'
+
+def test_precompress_cache(tmp_path):
+    cache = tmp_path / 'cache'
+    site = tmp_path / 'public'
+    make_site(site)
+    assert precompress('--cache', cache, site) == '3 files, 3 variants written, 0 from cache'
+    assert len(list(cache.iterdir())) == 3
+
+    # A site rebuilt from scratch reuses the cached variants of
+    # unchanged files, and unused cache entries are removed.
+    for p in sorted(site.rglob('*'), reverse=True):
+        p.rmdir() if p.is_dir() else p.unlink()
+    make_site(site)
+    (site / 'style.css').write_text('p { color: blue; }')
+    assert precompress('--cache', cache, site) == '3 files, 3 variants written, 2 from cache'
+    assert len(list(cache.iterdir())) == 3
+    assert gzip.decompress((site / 'style.css.gz').read_bytes()) == b'p { color: blue; }'
+    for name in ('index.html', 'journal/page.html', 'style.css'):
+        src = site / name
+        variant = site / (name + '.gz')
+        assert variant.stat().st_mtime_ns >= src.stat().st_mtime_ns
+        assert gzip.decompress(variant.read_bytes()) == src.read_bytes()